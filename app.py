@@ -1,29 +1,101 @@
+import hashlib
 import streamlit as st
 import pandas as pd
-import io
-import os
-from utils.data_utils import load_mappings, build_embeddings
-from utils.file_utils import process_file
-
-
-cpt_icd_mapping_df, cpt_mapping = load_mappings()
-icd_embedding_store = build_embeddings(cpt_icd_mapping_df)
-
-HEADERS = [
-    "Date",
-    "Appointment Type",
-    "Client Name",
-    "DOB",
-    "Service Code",
-    "Service Description",
-    "Clinician Name",
-    "POS",
-    "Modifier",
-    "Coding",
-    "Note Status",
-    "Status",
-    "Comments",
-]
+from config import JOB_POLL_S
+from utils.file_utils import HEADERS
+from utils.export_utils import EXPORT_FORMATS, export_bytes, parquet_available, results_digest
+from utils.jobs import JobQueue, QUEUED, RUNNING, FAILED
+from utils.result_cache import result_cache
+from utils.cpt_utils import cpt_rules
+from utils.prompt_utils import note_compactor
+from utils.tracing import memory_sink, stage_breakdown
+from utils.warmup import Warmup
+
+
+@st.cache_resource
+def start_warmup():
+    # One background warm-up per server process (mappings, ICD store, MedEmbed,
+    # cross-encoder, Gemini client); the page renders while it runs
+    return Warmup().start()
+
+
+@st.cache_resource
+def start_job_queue():
+    # One worker pool per server process, shared by every session; jobs left
+    # unfinished by a restart are resumed
+    return JobQueue(resources=start_warmup().result).start()
+
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def cached_export(digest: str, extension: str, _results_df: pd.DataFrame) -> bytes:
+    # Keyed by the result set's content hash (the DataFrame itself is not hashed),
+    # so reruns such as renaming the file reuse the serialized bytes
+    return export_bytes(_results_df, extension)
+
+
+def upload_sha256(uploaded_file) -> str:
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
+
+def session_job_ids() -> list:
+    # Kept in the URL (?jobs=...) so a reload or a shared link finds the jobs again
+    return [j for j in st.query_params.get("jobs", "").split(",") if j]
+
+
+def set_session_job_ids(job_ids: list):
+    st.query_params["jobs"] = ",".join(job_ids)
+
+
+def collect_jobs(job_ids: list):
+    """
+    Finished rows by file content hash (in job / submission order), hashes
+    still being processed or failed, and the status of unfinished jobs.
+    """
+    finished, pending, failed, active = {}, set(), {}, []
+    for job_id in job_ids:
+        job = job_queue.status(job_id)
+        if job is None:
+            continue
+        for f in job_queue.results(job_id):
+            if f["row"] is not None:
+                finished[f["sha256"]] = f["row"]
+            elif f["status"] == FAILED:
+                failed[f["sha256"]] = f"{f['name']}: {f['error']}"
+            elif job["status"] == FAILED:
+                failed[f["sha256"]] = f"Processing failed: {job['error']}"
+            else:
+                pending.add(f["sha256"])
+        if job["status"] in (QUEUED, RUNNING):
+            active.append(job)
+    # A file that failed once but was retried in a later job is no longer failed
+    failed = {h: e for h, e in failed.items() if h not in finished and h not in pending}
+    return finished, pending, failed, active
+
+
+def ordered_rows(finished: dict, hashes) -> list:
+    if hashes is None:
+        return list(finished.values())
+    return [finished[h] for h in hashes if h in finished]
+
+
+@st.fragment(run_every=JOB_POLL_S)
+def job_progress(job_ids: list, hashes):
+    finished, _, _, active = collect_jobs(job_ids)
+    if not active:
+        # Everything finished: redraw the whole page with the final table and export
+        st.rerun()
+    for job in active:
+        st.progress(
+            job["done"] / max(1, job["total"]),
+            text=f"Job {job['id']}: {job['done']} of {job['total']} files ({job['status']})",
+        )
+    rows = ordered_rows(finished, hashes)
+    if rows:
+        st.dataframe(pd.DataFrame(rows, columns=HEADERS), use_container_width=True)
+
+
+warmup = start_warmup()
+job_queue = start_job_queue()
 
 st.title("Robertson Practice")
 
@@ -31,66 +103,127 @@ uploaded_files = st.file_uploader(
     "Upload one or more SOAP notes (PDFs)", type="pdf", accept_multiple_files=True
 )
 
-# If files uploaded, process them
+job_ids = session_job_ids()
+with st.sidebar:
+    lookup = st.text_input("Job ID", placeholder="Fetch the results of a submitted job").strip()
+    if lookup and lookup not in job_ids:
+        if job_queue.status(lookup) is None:
+            st.warning(f"No job {lookup}")
+        else:
+            job_ids.append(lookup)
+            set_session_job_ids(job_ids)
+
+hashes = None
 if uploaded_files:
-    # Clear previous session if file list changes
-    if st.session_state.get("last_files") != [f.name for f in uploaded_files]:
-        st.session_state.pop("results_df", None)
-        st.session_state.pop("last_files", None)
-
-    if "results_df" not in st.session_state:
-        results = []
-        total_files = len(uploaded_files)
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-
-        for idx, uploaded_file in enumerate(uploaded_files, start=1):
-            row = process_file(
-                uploaded_file, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store
+    # Rows are kept per file content hash: only files without a finished or
+    # running result are submitted, and removed files simply drop out of the table
+    hashes = [upload_sha256(f) for f in uploaded_files]
+    finished, pending, failed, active = collect_jobs(job_ids)
+
+    todo = {}
+    for f, h in zip(uploaded_files, hashes):
+        if h not in finished and h not in pending and h not in failed and h not in todo:
+            todo[h] = f
+    retry = [f for f, h in zip(uploaded_files, hashes) if h in failed and h not in todo]
+    if retry and st.button(f"Retry {len(retry)} failed files"):
+        todo.update((upload_sha256(f), f) for f in retry)
+
+    if todo:
+        job_id = job_queue.submit(
+            [(f.name, f.getvalue()) for f in todo.values()], label=f"{len(todo)} files"
+        )
+        job_ids.append(job_id)
+        set_session_job_ids(job_ids)
+        st.session_state.cache_before = result_cache.stats()
+        st.session_state.rules_before = cpt_rules.stats()
+        st.session_state.tokens_before = note_compactor.stats()
+        st.session_state.trace_mark = memory_sink.count
+
+finished, pending, failed, active = collect_jobs(job_ids)
+# A failed job repeats its error for every file; show each distinct message once
+for error in dict.fromkeys(e for sha, e in failed.items() if hashes is None or sha in hashes):
+    st.error(error)
+
+if active:
+    job_progress(job_ids, hashes)
+elif job_ids and (hashes is None or finished):
+    rows = ordered_rows(finished, hashes)
+    if st.session_state.get("results_key") != (job_ids, hashes):
+        st.session_state.results_df = pd.DataFrame(rows, columns=HEADERS)
+        st.session_state.results_digest = results_digest(st.session_state.results_df)
+        st.session_state.results_key = (job_ids, hashes)
+        if "trace_mark" in st.session_state:
+            # Server-wide: includes any other jobs that ran at the same time
+            st.session_state.stage_breakdown = stage_breakdown(
+                memory_sink.since(st.session_state.pop("trace_mark"))
             )
-
-            results.append(row)
-
-            progress = idx / total_files
-            progress_bar.progress(progress)
-            status_text.text(
-                f"Processing file {idx} of {total_files}: {uploaded_file.name}"
+            before, after = st.session_state.pop("cache_before"), result_cache.stats()
+            rules_before, rules_after = st.session_state.pop("rules_before"), cpt_rules.stats()
+            rule_based = rules_after["rule_based"] - rules_before["rule_based"]
+            llm = rules_after["llm"] - rules_before["llm"]
+            tokens_before, tokens_after = st.session_state.pop("tokens_before"), note_compactor.stats()
+            notes = tokens_after["notes"] - tokens_before["notes"]
+            saved = (tokens_after["tokens_before"] - tokens_before["tokens_before"]) - (
+                tokens_after["tokens_after"] - tokens_before["tokens_after"]
+            )
+            st.session_state.cache_summary = (
+                f"Result cache: {after['hits'] - before['hits']} hits, "
+                f"{after['misses'] - before['misses']} misses; "
+                f"CPT rules: {rule_based} of {rule_based + llm} uncached notes skipped the LLM"
+                + (f"; prompt compaction saved {saved / notes:.0f} tokens per note" if notes else "")
             )
-
-        
-
-        st.session_state.results_df = pd.DataFrame(results, columns=HEADERS)
-        st.session_state.last_files = [f.name for f in uploaded_files]
 
     # Use cached results
     results_df = st.session_state.results_df
     st.subheader("Results Summary")
+    if st.session_state.get("cache_summary"):
+        st.caption(st.session_state.cache_summary)
     st.dataframe(results_df, use_container_width=True)
 
-    # Custom filename
+    breakdown = st.session_state.get("stage_breakdown")
+    if breakdown:
+        with st.expander("Per-stage timing"):
+            st.dataframe(pd.DataFrame(breakdown), use_container_width=True)
+
+    # Export format and custom filename
+    formats = [f for f in EXPORT_FORMATS if "parquet" not in f.lower() or parquet_available()]
+    export_format = st.selectbox("Export format:", formats)
+    extension, mime = EXPORT_FORMATS[export_format]
     default_filename = "robertson_coding_solved"
-    custom_name = st.text_input("Rename Excel file:", value=default_filename)
-    if not custom_name.endswith(".xlsx"):
-        custom_name += ".xlsx"
+    custom_name = st.text_input("Rename export file:", value=default_filename)
+    if not custom_name.endswith(f".{extension}"):
+        custom_name += f".{extension}"
 
-    buffer = io.BytesIO()
-    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
-        results_df.to_excel(writer, index=False, sheet_name="Results")
+    data = cached_export(st.session_state.results_digest, extension, results_df)
 
-    if st.download_button(
-        label="📥 Download Results as Excel",
-        data=buffer.getvalue(),
+    # Rows stay available after download so adding files later stays incremental
+    st.download_button(
+        label=f"📥 Download Results ({extension.upper()})",
+        data=data,
         file_name=custom_name,
-        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-    ):
-        # Clear session state after download
-        st.session_state.pop("results_df", None)
-        st.session_state.pop("last_files", None)
-
-        # Optionally delete files from data/ folder
-        for f in os.listdir("data"):
-            if f.endswith(".pdf"):
-                try:
-                    os.remove(os.path.join("data", f))
-                except Exception:
-                    pass
+        mime=mime,
+    )
+
+with st.sidebar:
+    if job_ids:
+        st.caption("Jobs")
+        for job_id in job_ids:
+            job = job_queue.status(job_id)
+            if job is not None:
+                st.text(f"{job_id}  {job['done']}/{job['total']}  {job['status']}")
+        if st.button("Clear jobs"):
+            for key in ("results_key", "results_df", "results_digest", "stage_breakdown", "cache_summary"):
+                st.session_state.pop(key, None)
+            set_session_job_ids([])
+            st.rerun()
+
+    st.caption("Startup")
+    if warmup.ui_ready is not None:
+        st.metric("UI ready", f"{warmup.ui_ready:.1f}s")
+    if warmup.ready():
+        st.metric("Models ready", f"{warmup.elapsed:.1f}s")
+        st.json(warmup.timings, expanded=False)
+    else:
+        st.caption(f"Models loading... {warmup.elapsed:.0f}s")
+
+warmup.mark_ui_ready()
@@ -0,0 +1,95 @@
+"""
+Build time, memory and query latency of the full ICD-10-CM ANN index
+(models.ann_index) against exact numpy scoring, plus recall of the ANN hits.
+
+    python -m benchmarks.bench_ann --codes 70000
+    python -m benchmarks.bench_ann --icd10cm data/icd10cm_codes_2025.txt --real-models
+
+Without --icd10cm a synthetic code set of --codes entries is used; without
+--real-models vectors come from models.fake_encoders.
+"""
+import argparse
+import resource
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import icd10cm_codes, soap_note_text
+from models.ann_index import ANN_BACKENDS, IcdAnnIndex
+from models.embeddings import build_icd_embedding_store, embed_texts, embed_notes, icd_candidate_rows
+from models.fake_encoders import install_fake_encoders
+from utils.data_utils import load_mappings, load_icd10cm, MAPPING_FILE
+from utils.note_scanner import scan_note
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def percentile_ms(samples, q) -> float:
+    return float(np.percentile(np.array(samples) * 1000, q))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_ann")
+    parser.add_argument("--icd10cm", help="ICD-10-CM code file (default: synthetic codes)")
+    parser.add_argument("--codes", type=int, default=70000, help="Synthetic code count")
+    parser.add_argument("--backends", nargs="+", default=list(ANN_BACKENDS), choices=ANN_BACKENDS)
+    parser.add_argument("--notes", type=int, default=100)
+    parser.add_argument("--k", type=int, default=200, help="Neighbours retrieved per query")
+    parser.add_argument("--real-models", action="store_true")
+    parser.add_argument("--mapping", default=MAPPING_FILE)
+    args = parser.parse_args(argv)
+
+    if not args.real_models:
+        install_fake_encoders()
+    mapping_df, _ = load_mappings(args.mapping)
+    if args.icd10cm:
+        icd10cm_df = load_icd10cm(args.icd10cm)
+    else:
+        icd10cm_df = pd.DataFrame(icd10cm_codes(args.codes), columns=["ICD-10 Code", "ICD-10 Description"])
+
+    start = time.perf_counter()
+    store = build_icd_embedding_store(mapping_df, embed_texts, icd10cm_df=icd10cm_df, ann_backend="exact")
+    print(f"{len(store)} ICD rows embedded in {time.perf_counter() - start:.1f}s; "
+          f"matrix {store.matrix.nbytes / 2**20:.1f} MB")
+
+    notes = [scan_note(soap_note_text(seed=i, pages=3))["clean"] for i in range(args.notes)]
+    queries = [np.atleast_2d(e) for e in embed_notes(notes)]
+    exact = store.ann
+
+    print(f"{'backend':<9}{'build s':>9}{'index MB':>10}{'RSS MB':>9}{'p50 ms':>9}{'p95 ms':>9}"
+          f"{f'recall@{args.k}':>12}{'cand p50 ms':>13}")
+    for backend in args.backends:
+        rss_before = peak_rss_mb()
+        ann = IcdAnnIndex.build(store.matrix, backend)
+        with tempfile.TemporaryDirectory() as tmp:
+            ann.save(tmp)
+            index_mb = ann.nbytes(tmp) / 2**20
+
+        latencies, recalls = [], []
+        for q in queries:
+            t0 = time.perf_counter()
+            rows, _ = ann.search(q, args.k)
+            latencies.append(time.perf_counter() - t0)
+            truth, _ = exact.search(q, args.k)
+            recalls.append(np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(rows, truth)]))
+
+        # Full candidate step: ANN retrieval + CPT category post-filter + mapped ICDs
+        store.ann = ann
+        cand = []
+        for q in queries:
+            t0 = time.perf_counter()
+            icd_candidate_rows(store, ["90837"], q)
+            cand.append(time.perf_counter() - t0)
+        store.ann = exact
+
+        print(f"{backend:<9}{ann.build_s:>9.2f}{index_mb:>10.1f}{peak_rss_mb() - rss_before:>9.1f}"
+              f"{percentile_ms(latencies, 50):>9.2f}{percentile_ms(latencies, 95):>9.2f}"
+              f"{np.mean(recalls):>12.3f}{percentile_ms(cand, 50):>13.2f}")
+
+
+if __name__ == "__main__":
+    main()
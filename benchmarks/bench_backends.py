@@ -0,0 +1,130 @@
+"""
+Accuracy and speed check of the embedding / cross-encoder inference backends
+(see config.EMBED_BACKEND). Every backend ranks the mapping file's ICD
+candidates for the same synthetic notes; rankings are compared with the fp32
+torch reference and encode / rerank throughput is reported.
+
+    python -m benchmarks.bench_backends --notes 50
+    python -m benchmarks.bench_backends --backends torch onnx-int8 --min-overlap 0.8
+
+The ONNX backends need `pip install sentence-transformers[onnx]`.
+"""
+import argparse
+import sys
+import time
+import numpy as np
+from benchmarks.synthetic import soap_note_text
+from config import EMBED_MODEL_NAME, CROSS_ENCODER_MODEL_NAME, MODEL_DEVICE
+from models.embeddings import (
+    BACKENDS,
+    load_model,
+    registry,
+    build_icd_embedding_store,
+    embed_texts,
+    embed_notes,
+    rank_icds_batch,
+)
+from utils.data_utils import load_mappings, MAPPING_FILE
+from utils.note_scanner import scan_note
+
+
+def make_cases(n: int, pages: int, cpt_mapping: dict):
+    """(clean note text, [service code]) per synthetic note."""
+    cases = []
+    for i in range(n):
+        scan = scan_note(soap_note_text(seed=i, pages=pages))
+        cpt = scan["phi"].get("Service Code")
+        cases.append((scan["clean"], [cpt if cpt in cpt_mapping else "90837"]))
+    return cases
+
+
+def run_backend(backend: str, df, cases, top_k: int) -> dict:
+    from sentence_transformers import SentenceTransformer, CrossEncoder
+
+    registry.evict()
+    start = time.perf_counter()
+    registry.register("embedder", load_model(SentenceTransformer, EMBED_MODEL_NAME, backend, MODEL_DEVICE))
+    registry.register("cross_encoder", load_model(CrossEncoder, CROSS_ENCODER_MODEL_NAME, backend, MODEL_DEVICE))
+    registry.warm_up()
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    store = build_icd_embedding_store(df, embed_texts)
+    icd_s = time.perf_counter() - start
+
+    notes = [clean for clean, _ in cases]
+    start = time.perf_counter()
+    note_embs = embed_notes(notes)
+    note_s = time.perf_counter() - start
+
+    embed_ranked, reranked = [], []
+    start = time.perf_counter()
+    for (clean, cpts), emb in zip(cases, note_embs):
+        ranked = rank_icds_batch([clean], [cpts], store, top_k=top_k, note_embs=[emb])[0]
+        reranked.append([r["icd"] for r in ranked])
+    rerank_s = time.perf_counter() - start
+    for (clean, cpts), emb in zip(cases, note_embs):
+        ranked = rank_icds_batch(
+            [clean], [cpts], store, top_k=top_k, rerank_with_cross_encoder=False, note_embs=[emb]
+        )[0]
+        embed_ranked.append([r["icd"] for r in ranked])
+
+    return {
+        "backend": backend,
+        "load_s": load_s,
+        "icd_keys_per_s": len(store) / icd_s,
+        "notes_per_s": len(notes) / note_s,
+        "rerank_ms": rerank_s / len(cases) * 1000,
+        "note_embs": note_embs,
+        "embed_ranked": embed_ranked,
+        "reranked": reranked,
+    }
+
+
+def agreement(ranked, reference, k: int) -> dict:
+    overlap = [len(set(a[:k]) & set(b[:k])) / max(1, min(k, len(b))) for a, b in zip(ranked, reference)]
+    top1 = [bool(a) and bool(b) and a[0] == b[0] for a, b in zip(ranked, reference)]
+    return {"overlap": float(np.mean(overlap)), "top1": float(np.mean(top1))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_backends")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--notes", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--mapping", default=MAPPING_FILE)
+    parser.add_argument("--min-overlap", type=float, default=0.0,
+                        help="Exit non-zero if any backend's reranked top-k overlap falls below this")
+    args = parser.parse_args(argv)
+
+    df, cpt_mapping = load_mappings(args.mapping)
+    cases = make_cases(args.notes, args.pages, cpt_mapping)
+    backends = ["torch"] + [b for b in args.backends if b != "torch"]
+    results = [run_backend(b, df, cases, args.top_k) for b in backends]
+    reference = results[0]
+
+    k = args.top_k
+    print(f"{'backend':<12}{'load s':>8}{'ICD keys/s':>12}{'notes/s':>10}{'rerank ms':>11}"
+          f"{'speedup':>9}{'cos':>8}{f'emb@{k}':>8}{'emb top1':>10}{f'rr@{k}':>8}{'rr top1':>9}")
+    failed = []
+    for r in results:
+        emb = agreement(r["embed_ranked"], reference["embed_ranked"], k)
+        rr = agreement(r["reranked"], reference["reranked"], k)
+        cos = float(np.mean(np.sum(
+            np.vstack(r["note_embs"]) * np.vstack(reference["note_embs"]), axis=1
+        )))
+        speedup = r["notes_per_s"] / reference["notes_per_s"]
+        print(f"{r['backend']:<12}{r['load_s']:>8.1f}{r['icd_keys_per_s']:>12.1f}{r['notes_per_s']:>10.2f}"
+              f"{r['rerank_ms']:>11.1f}{speedup:>8.2f}x{cos:>8.4f}{emb['overlap']:>8.2f}"
+              f"{emb['top1']:>10.2f}{rr['overlap']:>8.2f}{rr['top1']:>9.2f}")
+        if rr["overlap"] < args.min_overlap:
+            failed.append(r["backend"])
+
+    if failed:
+        print(f"Top-{k} overlap below {args.min_overlap:.2f} for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Micro-benchmark: utils.note_scanner.scan_note vs the per-function path
+(deidentify_and_strip + get_phi + extract_psych_eval_data) on multi-page
+synthetic notes. Fails if any output differs.
+
+    python -m benchmarks.bench_note_scanner --notes 200 --pages 6
+"""
+import argparse
+import time
+from benchmarks.synthetic import soap_note_text, psych_eval_text
+from utils.pdf_utils import deidentify_and_strip
+from utils.phi_utils import get_phi
+from utils.psych_eval_utils import extract_psych_eval_data
+from utils.note_scanner import scan_note
+
+PSYCH_CPTS = ["96130", "96131", "96138", "96139"]
+
+
+def legacy(text: str):
+    clean = deidentify_and_strip(text)
+    phi = get_phi(text)
+    psych = extract_psych_eval_data(text) if phi.get("Service Code") in PSYCH_CPTS else None
+    return clean, phi, psych
+
+
+def scanned(text: str):
+    scan = scan_note(text)
+    phi = scan["phi"]
+    psych = extract_psych_eval_data(text, scan) if phi.get("Service Code") in PSYCH_CPTS else None
+    return scan["clean"], phi, psych
+
+
+def time_it(fn, texts, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--notes", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    texts = [
+        (psych_eval_text if i % 4 == 0 else soap_note_text)(seed=i, pages=args.pages)
+        for i in range(args.notes)
+    ]
+
+    for i, text in enumerate(texts):
+        if legacy(text) != scanned(text):
+            raise SystemExit(f"Output mismatch on synthetic note {i}")
+
+    old = time_it(legacy, texts, args.repeat)
+    new = time_it(scanned, texts, args.repeat)
+    print(f"{len(texts)} notes x {args.pages} pages, best of {args.repeat}")
+    print(f"  legacy functions : {old * 1000:8.1f} ms ({len(texts) / old:8.0f} notes/s)")
+    print(f"  scan_note        : {new * 1000:8.1f} ms ({len(texts) / new:8.0f} notes/s)")
+    print(f"  speedup          : {old / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
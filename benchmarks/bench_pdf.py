@@ -0,0 +1,86 @@
+"""
+Pages/sec of each PDF text backend (see config.PDF_BACKEND) on synthetic
+multi-page evaluation reports: one file at a time, page ranges split
+across a process pool (as utils.pipeline does for large files), and a
+re-run served from the text cache. Also reports whether the notes scanned
+from each backend's text match the pypdf reference (PHI fields, clean text).
+
+    python -m benchmarks.bench_pdf --files 20 --pages 60
+    python -m benchmarks.bench_pdf --backends pypdf pymupdf --workers 4
+
+pymupdf needs `pip install pymupdf`; backends that are not installed are skipped.
+"""
+import argparse
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.pdf_writer import text_pdf
+from benchmarks.synthetic import psych_eval_pages
+from utils.pdf_utils import (
+    PDF_BACKENDS,
+    PdfTextCache,
+    resolve_backend,
+    extract_note,
+    extract_pages,
+    load_pdf,
+)
+from utils import pdf_utils
+
+
+def parallel_load(pool, data: bytes, pages: int, step: int, backend: str) -> str:
+    futures = [pool.submit(extract_pages, data, start, start + step, backend) for start in range(0, pages, step)]
+    return "\n".join(text for f in futures for text in f.result())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_pdf")
+    parser.add_argument("--backends", nargs="+", default=list(PDF_BACKENDS), choices=PDF_BACKENDS)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pages-per-task", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    corpus = [text_pdf(psych_eval_pages(seed=i, pages=args.pages)) for i in range(args.files)]
+    total_pages = args.files * args.pages
+    backends = [b for b in args.backends if resolve_backend(b) == b]
+    skipped = sorted(set(args.backends) - set(backends))
+    if skipped:
+        print(f"Not installed, skipped: {', '.join(skipped)}")
+
+    pdf_utils.pdf_text_cache = PdfTextCache("")
+    reference = [extract_note(f"{i}.pdf", data, "pypdf") for i, data in enumerate(corpus)]
+    mp_context = multiprocessing.get_context("spawn")
+    print(f"{'backend':<10}{'pages/s':>10}{'parallel pages/s':>18}{'cached pages/s':>16}{'same notes':>12}")
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), mp_context=mp_context) as pool:
+        # Start the workers before timing
+        list(pool.map(resolve_backend, backends * args.workers))
+        for backend in backends:
+            start = time.perf_counter()
+            texts = [load_pdf(data, backend) for data in corpus]
+            sequential_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            parallel = [parallel_load(pool, data, args.pages, args.pages_per_task, backend) for data in corpus]
+            parallel_s = time.perf_counter() - start
+            assert parallel == texts, f"{backend}: page-parallel text differs from sequential"
+
+            with tempfile.TemporaryDirectory() as cache_dir:
+                pdf_utils.pdf_text_cache = PdfTextCache(cache_dir)
+                notes = [extract_note(f"{i}.pdf", data, backend) for i, data in enumerate(corpus)]
+                start = time.perf_counter()
+                for i, data in enumerate(corpus):
+                    extract_note(f"{i}.pdf", data, backend)
+                cached_s = time.perf_counter() - start
+            pdf_utils.pdf_text_cache = PdfTextCache("")
+
+            same = sum(
+                n["clean"] == r["clean"] and n["phi"] == r["phi"] for n, r in zip(notes, reference)
+            )
+            print(f"{backend:<10}{total_pages / sequential_s:>10.0f}{total_pages / parallel_s:>18.0f}"
+                  f"{total_pages / cached_s:>16.0f}{f'{same}/{len(corpus)}':>12}")
+
+
+if __name__ == "__main__":
+    main()
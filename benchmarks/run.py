@@ -0,0 +1,311 @@
+"""
+End-to-end benchmark on synthetic SOAP / psych-evaluation PDFs.
+
+Gemini is replaced by models.fake_llm (configurable latency) and, unless
+--real-models is given, MedEmbed / the cross-encoder by models.fake_encoders.
+Each stage is timed per note; the report is compared against a saved
+baseline and the run exits non-zero on a regression.
+
+    python -m benchmarks.run --notes 100 --llm-latency 0.3
+    python -m benchmarks.run --notes 100 --save-baseline
+"""
+import argparse
+import io
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from benchmarks.pdf_writer import text_pdf
+from benchmarks.synthetic import soap_note_pages, long_soap_note_pages, psych_eval_pages
+from models.fake_llm import install_fake_llm
+from models.fake_encoders import install_fake_encoders
+from models.llm import llm_rate_limiter
+from models.embeddings import (
+    build_icd_embedding_store,
+    embed_texts,
+    embed_notes,
+    rank_icds_batch,
+)
+from utils.cpt_utils import predict_cpt_code, rule_based_cpt
+from utils.icd_utils import select_icds_for_note
+from utils.data_utils import load_mappings, MAPPING_FILE
+from utils.file_utils import HEADERS, process_file, is_psych_eval
+from utils.export_utils import export_bytes
+from utils.note_scanner import strip_lines, extract_phi
+from utils.pdf_utils import load_pdf
+from utils.pipeline import process_files
+from utils.prompt_utils import note_compactor
+from utils.result_cache import result_cache
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+
+class MemoryFile(io.BytesIO):
+    """BytesIO with a .name, like a Streamlit UploadedFile."""
+
+    def __init__(self, name: str, data: bytes):
+        super().__init__(data)
+        self.name = name
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        yield
+        self.samples[stage].append(time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        out = {}
+        for stage, values in self.samples.items():
+            ms = np.array(values) * 1000
+            out[stage] = {
+                "count": len(values),
+                "p50_ms": round(float(np.percentile(ms, 50)), 3),
+                "p95_ms": round(float(np.percentile(ms, 95)), 3),
+            }
+        return out
+
+
+def normalize_row(row: dict) -> dict:
+    # get_phi orders diagnosis codes via set(), which differs between processes
+    row = dict(row)
+    row["Primary Diagnosis"] = sorted(row["Primary Diagnosis"].split(", "))
+    cpts, _, icds = row["Coding"].rpartition("--")
+    row["Coding"] = (cpts, sorted(icds.split(", ")))
+    return row
+
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def make_corpus(n: int, pages: int, psych_every: int, long_every: int = 0):
+    corpus = []
+    for i in range(n):
+        if psych_every and i % psych_every == 0:
+            corpus.append(MemoryFile(f"psych_{i:05d}.pdf", text_pdf(psych_eval_pages(i, pages + 1))))
+        elif long_every and i % long_every == 1:
+            # Over PROMPT_TOKEN_BUDGET, so the compaction regression check covers cutting lines
+            corpus.append(MemoryFile(f"long_{i:05d}.pdf", text_pdf(long_soap_note_pages(i))))
+        else:
+            corpus.append(MemoryFile(f"soap_{i:05d}.pdf", text_pdf(soap_note_pages(i, pages))))
+    return corpus
+
+
+def run(args) -> dict:
+    install_fake_llm(latency=args.llm_latency)
+    llm_rate_limiter.rate = args.llm_rate
+    if not args.real_models:
+        install_fake_encoders(args.embed_latency, args.cross_latency)
+    result_cache.enabled = False
+
+    corpus = make_corpus(args.notes, args.pages, args.psych_every, args.long_every)
+    cpt_icd_mapping_df, cpt_mapping = load_mappings(args.mapping)
+
+    timer = StageTimer()
+    with timer.time("icd_store_build"):
+        store = build_icd_embedding_store(cpt_icd_mapping_df, embed_texts)
+
+    # Per-stage timings, one note at a time
+    scored = []
+    rule_hits = rule_agree = 0
+    for f in corpus:
+        data = f.getvalue()
+        with timer.time("pdf_load"):
+            text = load_pdf(data)
+        with timer.time("deidentify"):
+            clean = strip_lines(text)
+        with timer.time("phi"):
+            phi = extract_phi(text)
+        if is_psych_eval({"phi": phi}):
+            continue
+        with timer.time("embedding"):
+            note_emb = embed_notes([clean])[0]
+        with timer.time("cpt_rules"):
+            rule_cpts = rule_based_cpt(clean, phi)
+        with timer.time("llm_cpt"):
+            cpts = predict_cpt_code(clean)
+        if rule_cpts is not None:
+            rule_hits += 1
+            rule_agree += rule_cpts == cpts
+        with timer.time("cross_encoder_rerank"):
+            ranked = rank_icds_batch([clean], [cpts], store, top_k=5, note_embs=[note_emb])[0]
+        scored.append((clean, cpts, note_emb))
+        with timer.time("llm_icd"):
+            select_icds_for_note(clean, cpts, ranked)
+
+    # The same ICD ranking as one batch (per-note time = batch time / notes)
+    if scored:
+        start = time.perf_counter()
+        texts, cpts_per_note, embs = map(list, zip(*scored))
+        rank_icds_batch(texts, cpts_per_note, store, top_k=5, note_embs=embs)
+        batch_s = time.perf_counter() - start
+        timer.samples["rerank_batched"].extend([batch_s / len(scored)] * len(scored))
+
+    # Sequential end to end
+    rows = []
+    tokens_before = note_compactor.stats()
+    start = time.perf_counter()
+    for f in corpus:
+        f.seek(0)
+        with timer.time("process_file"):
+            rows.append(process_file(f, cpt_mapping, cpt_icd_mapping_df, store))
+    sequential_s = time.perf_counter() - start
+    tokens = {k: v - tokens_before[k] for k, v in note_compactor.stats().items()}
+
+    # Regression check: the same notes coded from the full, uncompacted text
+    compaction_matches_full = None
+    if note_compactor.enabled:
+        note_compactor.enabled = False
+        full_rows = []
+        for f in corpus:
+            f.seek(0)
+            full_rows.append(process_file(f, cpt_mapping, cpt_icd_mapping_df, store))
+        note_compactor.enabled = True
+        compaction_matches_full = [normalize_row(r) for r in rows] == [normalize_row(r) for r in full_rows]
+
+    # Concurrent pipeline end to end
+    for f in corpus:
+        f.seek(0)
+    start = time.perf_counter()
+    pipeline_rows = [None] * len(corpus)
+    for idx, row in process_files(corpus, cpt_mapping, cpt_icd_mapping_df, store):
+        pipeline_rows[idx] = row
+    pipeline_s = time.perf_counter() - start
+
+    results_df = pd.DataFrame(rows, columns=HEADERS)
+    with timer.time("excel_export"):
+        export_bytes(results_df, "xlsx")
+
+    return {
+        "config": {
+            "notes": args.notes,
+            "pages": args.pages,
+            "psych_every": args.psych_every,
+            "long_every": args.long_every,
+            "llm_latency": args.llm_latency,
+            "llm_rate": args.llm_rate,
+            "real_models": args.real_models,
+        },
+        "stages": timer.summary(),
+        "sequential_notes_per_s": round(len(corpus) / sequential_s, 3),
+        "pipeline_notes_per_s": round(len(corpus) / pipeline_s, 3),
+        "pipeline_matches_sequential": [normalize_row(r) for r in pipeline_rows]
+        == [normalize_row(r) for r in rows],
+        "prompt_tokens_saved_per_note": round(
+            (tokens["tokens_before"] - tokens["tokens_after"]) / tokens["notes"], 1
+        ) if tokens["notes"] else 0.0,
+        "prompt_tokens_after_per_note": round(tokens["tokens_after"] / tokens["notes"], 1)
+        if tokens["notes"] else 0.0,
+        "prompt_over_budget_notes": tokens["over_budget"],
+        "compaction_matches_full": compaction_matches_full,
+        "cpt_rule_notes": rule_hits,
+        "cpt_rule_llm_agreement": round(rule_agree / rule_hits, 3) if rule_hits else None,
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float, min_delta_ms: float = 1.0) -> list:
+    """
+    Return human-readable regressions (latency up or throughput down beyond
+    tolerance). Latency changes below min_delta_ms are treated as noise.
+    """
+    regressions = []
+    for stage, stats in report["stages"].items():
+        base = baseline.get("stages", {}).get(stage)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms"):
+            if stats[key] > base[key] * (1 + tolerance) and stats[key] - base[key] > min_delta_ms:
+                regressions.append(f"{stage} {key}: {stats[key]:.2f} vs baseline {base[key]:.2f}")
+    for key in ("sequential_notes_per_s", "pipeline_notes_per_s"):
+        if key in baseline and report[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {report[key]:.2f} vs baseline {baseline[key]:.2f}")
+    return regressions
+
+
+def print_report(report: dict):
+    print(f"{'stage':<22}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}")
+    for stage, stats in report["stages"].items():
+        print(f"{stage:<22}{stats['count']:>7}{stats['p50_ms']:>11.2f}{stats['p95_ms']:>11.2f}")
+    print(f"sequential: {report['sequential_notes_per_s']:.2f} notes/s")
+    print(f"pipeline:   {report['pipeline_notes_per_s']:.2f} notes/s "
+          f"(rows identical: {report['pipeline_matches_sequential']})")
+    if "cpt_rule_notes" in report:
+        print(f"CPT rules:  {report['cpt_rule_notes']} notes skipped the LLM "
+              f"(agreement with the LLM: {report['cpt_rule_llm_agreement']})")
+    if report.get("compaction_matches_full") is not None:
+        print(f"compaction: {report['prompt_tokens_saved_per_note']:.0f} tokens saved per note, "
+              f"{report['prompt_tokens_after_per_note']:.0f} sent, "
+              f"{report.get('prompt_over_budget_notes', 0)} notes over budget "
+              f"(codes identical to uncompacted: {report['compaction_matches_full']})")
+    print(f"peak RSS:   {report['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--notes", type=int, default=50)
+    parser.add_argument("--pages", type=int, default=3)
+    parser.add_argument("--psych-every", type=int, default=5,
+                        help="Every Nth note is a psych evaluation (0 disables)")
+    parser.add_argument("--long-every", type=int, default=10,
+                        help="Every Nth note is a long note over the prompt token budget (0 disables)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="Fake Gemini latency (s)")
+    parser.add_argument("--llm-rate", type=float, default=0.0,
+                        help="Token-bucket rate for the fake LLM (requests/s, 0 = unlimited)")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Fake encoder latency per text (s)")
+    parser.add_argument("--cross-latency", type=float, default=0.0, help="Fake cross-encoder latency per pair (s)")
+    parser.add_argument("--real-models", action="store_true", help="Use MedEmbed and the real cross-encoder")
+    parser.add_argument("--mapping", default=MAPPING_FILE)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--json", help="Also write the report to this path")
+    args = parser.parse_args(argv)
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if report["compaction_matches_full"] is False:
+        print("REGRESSION: prompt compaction changed CPT/ICD output on the benchmark corpus")
+        sys.exit(1)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("Baseline was recorded with a different config; comparison skipped")
+        return
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for r in regressions:
+            print(f"  {r}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.tolerance:.0%} of baseline")
+
+
+if __name__ == "__main__":
+    main()
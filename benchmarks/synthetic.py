@@ -0,0 +1,149 @@
+"""
+Deterministic synthetic note text in the layouts get_phi, check_note and
+extract_psych_eval_data expect. No real PHI; names and codes are drawn from
+small fixed pools with a seeded RNG.
+"""
+import random
+from typing import List
+
+CLINICIANS = ["Alex Morgan, LCSW", "Jordan Lee, LPC", "Sam Rivera, PhD", "Taylor Kim, LMFT"]
+PATIENTS = ["Casey Brooks", "Riley Evans", "Jamie Foster", "Avery Hughes", "Quinn Parker"]
+LOCATIONS = ["Telehealth video visit", "Main Street Clinic", "Virtual session", "Riverside Center"]
+DIAGNOSES = [
+    ("F41.1", "Generalized anxiety disorder"),
+    ("F32.1", "Major depressive disorder, single episode, moderate"),
+    ("F43.10", "Post-traumatic stress disorder, unspecified"),
+    ("F90.0", "Attention-deficit hyperactivity disorder, predominantly inattentive type"),
+    ("F43.23", "Adjustment disorder with mixed anxiety and depressed mood"),
+    ("F33.1", "Major depressive disorder, recurrent, moderate"),
+]
+FILLER = [
+    "Client reported improved sleep and fewer intrusive thoughts since last session.",
+    "Therapist used cognitive restructuring to challenge catastrophic thinking.",
+    "Client practiced diaphragmatic breathing and grounding in session.",
+    "Discussed triggers at work and rehearsed assertive communication.",
+    "Client identified three coping strategies to use before the next appointment.",
+    "Reviewed homework; client completed two of three thought records.",
+    "Affect congruent with mood; client engaged and receptive to feedback.",
+]
+SOAP_DURATIONS = [(30, "90832"), (45, "90832"), (53, "90837"), (60, "90837"), (75, "90839"), (90, "H0004")]
+
+
+def _header(rng: random.Random, service_code: str, duration: int) -> List[str]:
+    month, day = rng.randint(1, 12), rng.randint(1, 28)
+    return [
+        f"Clinician: {rng.choice(CLINICIANS)}",
+        f"Supervisor: {rng.choice(CLINICIANS)}",
+        f"Patient: {rng.choice(PATIENTS)}, DOB {rng.randint(1, 12):02d}/{rng.randint(1, 28):02d}/{rng.randint(1950, 2010)}",
+        f"Date and Time: {month:02d}/{day:02d}/2025 {rng.randint(8, 17)}:00 PM",
+        f"Duration: {duration} minutes",
+        f"Service Code: {service_code}",
+        f"Location: {rng.choice(LOCATIONS)}",
+    ]
+
+
+def soap_note_pages(seed: int = 0, pages: int = 2) -> List[str]:
+    """Pages of a psychotherapy progress note; the note is complete (no missing sections)."""
+    rng = random.Random(seed)
+    duration, service_code = rng.choice(SOAP_DURATIONS)
+    diagnoses = rng.sample(DIAGNOSES, 2)
+    body = _header(rng, service_code, duration) + ["Diagnosis"]
+    body += [f"{code} {desc}" for code, desc in diagnoses]
+    body += ["Interventions Used", "Cognitive Behavioral Therapy; Mindfulness"]
+    body += ["Risk Assessment", "Client denies suicidal or homicidal ideation."]
+    body += ["Current Mental Status", "Alert and oriented x4, mood anxious, affect congruent."]
+    body += ["Treatment Plan Progress", "Objectives", "Client will reduce anxiety episodes to two per week."]
+
+    per_page = max(1, len(FILLER) * 2 // max(1, pages))
+    result = []
+    for page in range(1, pages + 1):
+        lines = list(body) if page == 1 else []
+        lines += [rng.choice(FILLER) for _ in range(per_page)]
+        if page == pages:
+            lines += ["Plan", "Continue weekly sessions.", "License #LCSW-000000"]
+        lines.append(f"Page {page} of {pages}")
+        result.append("\n".join(lines))
+    return result
+
+
+RISK_SCREEN = [
+    "Suicidal ideation?", "Denies",
+    "Homicidal ideation?", "Denies",
+    "Self-harm since last session?", "Denies",
+    "Access to firearms?", "No",
+]
+
+
+def long_soap_note_pages(seed: int = 0, pages: int = 8) -> List[str]:
+    """
+    A progress note well over the prompt token budget: every page repeats
+    the practice header and a risk screen with repeated short answers, and
+    carries a full page of session narrative.
+    """
+    rng = random.Random(seed)
+    result = []
+    for page, text in enumerate(soap_note_pages(seed, pages), start=1):
+        lines = text.split("\n")
+        practice = "Robertson Practice behavioral health progress note, confidential record"
+        # Distinct lines, so the note stays over budget after de-duplication
+        narrative = [f"{rng.choice(FILLER)[:-1]} (minute {rng.randint(1, 60)}, page {page})." for _ in range(20)]
+        # Keep the page footer last
+        result.append("\n".join([practice] + lines[:-1] + RISK_SCREEN + narrative + lines[-1:]))
+    return result
+
+
+def psych_eval_pages(seed: int = 0, pages: int = 3) -> List[str]:
+    """Pages of a psychological testing evaluation report (96130/96131/96138/96139)."""
+    rng = random.Random(seed)
+    service_code = rng.choice(["96130", "96131", "96138", "96139"])
+    procedures = [
+        f"Clinical interview {rng.choice([30, 45, 60])} minutes",
+        f"Test administration by psychometrist {rng.choice([60, 90, 120])} minutes",
+        f"Scoring and interpretation {rng.choice([30, 60])} minutes",
+    ]
+    total = sum(int(p.split()[-2]) for p in procedures)
+    diagnoses = rng.sample(DIAGNOSES, 2)
+
+    result = []
+    for page in range(1, pages + 1):
+        lines = []
+        if page == 1:
+            lines += _header(rng, service_code, total)
+            lines += ["Reason for Referral", "Evaluation of attention and mood concerns."]
+        lines += [rng.choice(FILLER) for _ in range(6)]
+        if page == pages:
+            lines += ["Procedures"] + procedures
+            lines += [f"Total Time Spent: {total} minutes", "Diagnosis"]
+            lines += [f"{code} {desc}" for code, desc in diagnoses]
+            lines += ["Recommendations", "Follow up with prescriber."]
+        lines.append(f"Page {page} of {pages}")
+        result.append("\n".join(lines))
+    return result
+
+
+def soap_note_text(seed: int = 0, pages: int = 2) -> str:
+    return "\n".join(soap_note_pages(seed, pages))
+
+
+def psych_eval_text(seed: int = 0, pages: int = 3) -> str:
+    return "\n".join(psych_eval_pages(seed, pages))
+
+
+ICD_WORDS = [
+    "disorder", "episode", "recurrent", "moderate", "severe", "mild", "unspecified", "chronic",
+    "acute", "anxiety", "depressive", "adjustment", "stress", "reaction", "syndrome", "type",
+    "with", "without", "mood", "sleep", "attention", "deficit", "fracture", "injury", "left",
+    "right", "upper", "lower", "limb", "infection", "disease", "complication", "encounter",
+    "initial", "subsequent", "sequela", "due", "to", "other", "specified", "persistent",
+]
+
+
+def icd10cm_codes(n: int, seed: int = 0) -> List[tuple]:
+    """n unique (code, description) pairs shaped like the CMS ICD-10-CM code file (no dots)."""
+    rng = random.Random(seed)
+    codes = {}
+    while len(codes) < n:
+        code = rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") + f"{rng.randint(0, 99):02d}"
+        code += "".join(rng.choice("0123456789AXY") for _ in range(rng.randint(0, 4)))
+        codes.setdefault(code, " ".join(rng.choice(ICD_WORDS) for _ in range(rng.randint(3, 9))).capitalize())
+    return list(codes.items())
@@ -0,0 +1,208 @@
+"""
+Headless batch entry point (no Streamlit).
+
+    python -m cli batch data/notes -o out.xlsx
+    python -m cli batch "backfill/2025-*/*.pdf" -o out.xlsx --resume
+    python -m cli batch data/notes -o out.parquet
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+import pandas as pd
+from config import PDF_BACKEND
+from utils.data_utils import load_mappings, build_embeddings, MAPPING_FILE
+from utils.file_utils import HEADERS, is_error_row
+from utils.export_utils import export_bytes
+from utils.pipeline import process_files
+from utils.result_cache import result_cache
+from utils.cpt_utils import cpt_rules
+from utils.prompt_utils import note_compactor
+from utils.tracing import memory_sink, stage_breakdown
+
+# Path of each note relative to the batch source (the directory, or a glob's fixed prefix)
+FILE_COLUMN = "File"
+
+
+class LocalFile:
+    """Minimal stand-in for a Streamlit UploadedFile backed by a path on disk."""
+
+    def __init__(self, path: str, name: str = None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+def collect_pdfs(source: str):
+    if os.path.isdir(source):
+        pattern = os.path.join(source, "**", "*.pdf")
+        paths = glob.glob(pattern, recursive=True)
+    else:
+        paths = glob.glob(source, recursive=True)
+    return sorted(p for p in paths if p.lower().endswith(".pdf"))
+
+
+def source_root(source: str) -> str:
+    """Directory that file keys are relative to: source itself, or a glob's fixed prefix."""
+    if os.path.isdir(source):
+        return source
+    prefix = re.split(r"[*?\[]", source, maxsplit=1)[0]
+    return os.path.dirname(prefix) or "."
+
+
+def file_key(path: str, root: str) -> str:
+    # Relative paths keep same-named files in different folders apart
+    return os.path.relpath(path, root).replace(os.sep, "/")
+
+
+def output_extension(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return ext if ext in ("csv", "parquet") else "xlsx"
+
+
+def read_results(path: str) -> pd.DataFrame:
+    ext = output_extension(path)
+    if ext == "csv":
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    if ext == "parquet":
+        return pd.read_parquet(path).astype(str)
+    return pd.read_excel(path, dtype=str, keep_default_na=False)
+
+
+def write_results(df: pd.DataFrame, path: str):
+    # Serialize in memory (pandas picks the Excel engine from the file extension, so a
+    # ".tmp" path is rejected), then swap the file in so an interrupted run never
+    # leaves a truncated output
+    data = export_bytes(df, output_extension(path))
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def run_batch(source: str, output: str, resume: bool = False,
+              mapping_file: str = MAPPING_FILE, checkpoint_every: int = 50) -> pd.DataFrame:
+    columns = [FILE_COLUMN] + HEADERS
+    paths = collect_pdfs(source)
+    root = source_root(source)
+    keys = [file_key(p, root) for p in paths]
+
+    done_rows = {}
+    if resume and os.path.exists(output):
+        previous = read_results(output)
+        if FILE_COLUMN in previous.columns:
+            # Files that failed last time are tried again
+            done_rows = {
+                r[FILE_COLUMN]: r for r in previous.reindex(columns=columns).to_dict("records")
+                if not is_error_row(r)
+            }
+    todo = [(p, k) for p, k in zip(paths, keys) if k not in done_rows]
+    print(
+        f"{len(paths)} PDFs found, {len(paths) - len(todo)} already in {output}, "
+        f"{len(todo)} to process",
+        file=sys.stderr,
+    )
+
+    cpt_icd_mapping_df, cpt_mapping = load_mappings(mapping_file)
+    icd_embedding_store = build_embeddings(cpt_icd_mapping_df, mapping_file)
+
+    def snapshot() -> pd.DataFrame:
+        rows = [done_rows[key] for key in keys if key in done_rows]
+        return pd.DataFrame(rows, columns=columns)
+
+    files = [LocalFile(p, k) for p, k in todo]
+    trace_mark = memory_sink.count
+    errors = 0
+    start = time.perf_counter()
+    for done, (idx, row) in enumerate(
+        process_files(files, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store), start=1
+    ):
+        done_rows[files[idx].name] = {FILE_COLUMN: files[idx].name, **row}
+        elapsed = time.perf_counter() - start
+        failed = f" {row['Comments']}" if is_error_row(row) else ""
+        errors += bool(failed)
+        print(
+            f"[{done}/{len(files)}] {files[idx].name} ({done / elapsed:.2f} notes/s){failed}",
+            file=sys.stderr,
+        )
+        if done % checkpoint_every == 0:
+            write_results(snapshot(), output)
+
+    elapsed = time.perf_counter() - start
+    results_df = snapshot()
+    write_results(results_df, output)
+
+    stats = result_cache.stats()
+    rules = cpt_rules.stats()
+    tokens = note_compactor.stats()
+    rate = len(files) / elapsed if elapsed > 0 and files else 0.0
+    print(
+        f"Processed {len(files)} notes in {elapsed:.1f}s ({rate:.2f} notes/s); "
+        f"result cache {stats['hits']} hits / {stats['misses']} misses; "
+        f"CPT rules {rules['rule_based']} notes / LLM {rules['llm']} notes; "
+        f"wrote {len(results_df)} rows to {output}"
+        + (f" ({errors} failed; rerun with --resume to retry them)" if errors else ""),
+        file=sys.stderr,
+    )
+    if tokens["notes"]:
+        saved = tokens["tokens_before"] - tokens["tokens_after"]
+        print(
+            f"Prompt compaction: {tokens['tokens_before']} -> {tokens['tokens_after']} note tokens "
+            f"({saved / tokens['notes']:.0f} saved per note, {tokens['over_budget']} notes over budget)",
+            file=sys.stderr,
+        )
+    if icd_embedding_store.ann is not None:
+        ann = icd_embedding_store.ann
+        print(
+            f"ICD ANN index: {len(ann)} codes ({ann.backend}), built in {ann.build_s:.1f}s, "
+            f"~{ann.nbytes() / 2**20:.0f} MB index + "
+            f"{icd_embedding_store.matrix.nbytes / 2**20:.0f} MB vectors",
+            file=sys.stderr,
+        )
+    records = memory_sink.since(trace_mark)
+    loads = [s for r in records for s in r["spans"] if s["name"] == "load_pdf"]
+    parsed = [s for s in loads if not s.get("cached")]
+    if loads:
+        pages = sum(s.get("pages", 0) for s in parsed)
+        load_s = sum(s["ms"] for s in parsed) / 1000
+        print(
+            f"PDF text ({PDF_BACKEND}): {pages} pages parsed"
+            + (f" at {pages / load_s:.0f} pages/s per worker" if load_s > 0 else "")
+            + f", {len(loads) - len(parsed)} files from the text cache",
+            file=sys.stderr,
+        )
+    for stage in stage_breakdown(records):
+        print(
+            f"  {stage['Stage']:<24}{stage['Calls']:>7} calls{stage['Total (s)']:>10.2f}s"
+            f"{stage['Mean (ms)']:>10.1f}ms mean",
+            file=sys.stderr,
+        )
+    return results_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m cli", description="Robertson Practice batch coding")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    batch = sub.add_parser("batch", help="Code a directory or glob of PDF notes")
+    batch.add_argument("source", help="Directory (searched recursively) or glob of PDFs")
+    batch.add_argument("-o", "--output", default="robertson_coding_solved.xlsx",
+                       help="Output .xlsx, .csv or .parquet file")
+    batch.add_argument("--resume", action="store_true",
+                       help="Skip files already present in the output file")
+    batch.add_argument("--mapping", default=MAPPING_FILE, help="CPT to ICD mapping workbook")
+    batch.add_argument("--checkpoint-every", type=int, default=50,
+                       help="Rewrite the output every N processed notes")
+
+    args = parser.parse_args(argv)
+    if args.command == "batch":
+        run_batch(args.source, args.output, args.resume, args.mapping, args.checkpoint_every)
+
+
+if __name__ == "__main__":
+    main()
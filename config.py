@@ -4,3 +4,115 @@ from dotenv import load_dotenv
 load_dotenv()
 
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+
+# Embedding / reranking models
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "abhinand/MedEmbed-large-v0.1")
+CROSS_ENCODER_MODEL_NAME = os.getenv(
+    "CROSS_ENCODER_MODEL_NAME", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+)
+MODEL_DEVICE = os.getenv("MODEL_DEVICE", "cpu")
+# Inference backend per model: torch | torch-int8 | onnx | onnx-int8
+# (the ONNX backends need `pip install sentence-transformers[onnx]`)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+CROSS_ENCODER_BACKEND = os.getenv("CROSS_ENCODER_BACKEND", "torch")
+# Instruction set targeted by the int8 ONNX export: arm64 | avx2 | avx512 | avx512_vnni
+ONNX_QUANTIZATION = os.getenv("ONNX_QUANTIZATION", "avx2")
+ONNX_EXPORT_DIR = os.getenv("ONNX_EXPORT_DIR", ".cache/onnx")
+# 0 keeps the torch default thread count
+MODEL_NUM_THREADS = int(os.getenv("MODEL_NUM_THREADS", "0"))
+
+# Long notes are embedded as overlapping word windows instead of being truncated
+# at the model's max sequence length; ICD similarity is pooled over windows
+# (max | mean) and the cross-encoder only sees the best-matching windows.
+NOTE_CHUNKING = os.getenv("NOTE_CHUNKING", "1") == "1"
+NOTE_CHUNK_WORDS = int(os.getenv("NOTE_CHUNK_WORDS", "200"))
+NOTE_CHUNK_OVERLAP_WORDS = int(os.getenv("NOTE_CHUNK_OVERLAP_WORDS", "50"))
+NOTE_CHUNK_POOLING = os.getenv("NOTE_CHUNK_POOLING", "max")
+CROSS_ENCODER_WINDOWS = int(os.getenv("CROSS_ENCODER_WINDOWS", "1"))
+
+# Persisted ICD embedding matrices, one sub-directory per mapping file hash + model
+ICD_EMBEDDING_CACHE_DIR = os.getenv("ICD_EMBEDDING_CACHE_DIR", ".cache/icd_embeddings")
+# Parsed mapping sheet snapshots (pickle), one per mapping file hash
+MAPPING_SNAPSHOT_DIR = os.getenv("MAPPING_SNAPSHOT_DIR", ".cache/mappings")
+
+# Optional full ICD-10-CM candidate set (CMS code file, or .csv/.xlsx with code and
+# description columns). When set, candidates come from an approximate nearest-neighbour
+# index over every code instead of only the mapping sheet's per-CPT lists.
+ICD10CM_FILE = os.getenv("ICD10CM_FILE", "")
+# exact (numpy scan; no extra dependency) | hnswlib | faiss
+# (the approximate backends need `pip install hnswlib` / `pip install faiss-cpu`)
+ANN_BACKEND = os.getenv("ANN_BACKEND", "exact")
+ANN_CANDIDATES = int(os.getenv("ANN_CANDIDATES", "200"))
+HNSW_M = int(os.getenv("HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "256"))
+# Post-filter on ANN hits: "category" keeps codes whose 3-character category appears in
+# the predicted CPTs' mapping-sheet ICDs, "none" keeps every hit
+ANN_CPT_FILTER = os.getenv("ANN_CPT_FILTER", "category")
+
+# Batch pipeline
+PIPELINE_PDF_WORKERS = int(os.getenv("PIPELINE_PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PIPELINE_LLM_CONCURRENCY = int(os.getenv("PIPELINE_LLM_CONCURRENCY", "8"))
+PIPELINE_EMBED_BATCH_SIZE = int(os.getenv("PIPELINE_EMBED_BATCH_SIZE", "16"))
+
+# Gemini client
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gemini-2.5-flash")
+# Requests per second allowed by the token bucket (0 disables rate limiting)
+LLM_RATE_PER_SEC = float(os.getenv("LLM_RATE_PER_SEC", "4"))
+LLM_BURST = int(os.getenv("LLM_BURST", "8"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+LLM_TIMEOUT_S = float(os.getenv("LLM_TIMEOUT_S", "60"))
+
+# Time-determined psychotherapy notes (duration + service code, no crisis / intake cues) get
+# their CPT from rules in utils.cpt_utils; every other note still goes to the LLM
+CPT_RULES_ENABLED = os.getenv("CPT_RULES_ENABLED", "1") == "1"
+
+# One structured call per note returning CPTs and ICDs together (instead of a CPT call then an
+# ICD call); its ICD list is ranked over the ICDs of every allowed CPT, keeping this many
+LLM_COMBINED_CODING = os.getenv("LLM_COMBINED_CODING", "0") == "1"
+COMBINED_ICD_TOP_K = int(os.getenv("COMBINED_ICD_TOP_K", "10"))
+
+# Notes sent to Gemini are de-duplicated and, above PROMPT_TOKEN_BUDGET tokens, cut down to
+# CPT cues and clinical sections (utils.prompt_utils). Tokens are counted with PROMPT_TOKENIZER's
+# locally cached Hugging Face tokenizer, or approximated when it is not cached
+PROMPT_COMPACTION = os.getenv("PROMPT_COMPACTION", "1") == "1"
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+PROMPT_TOKENIZER = os.getenv("PROMPT_TOKENIZER", EMBED_MODEL_NAME)
+
+# Local cache of LLM coding results keyed by de-identified note text
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+RESULT_CACHE_PATH = os.getenv("RESULT_CACHE_PATH", ".cache/results.sqlite3")
+RESULT_CACHE_TTL_S = float(os.getenv("RESULT_CACHE_TTL_S", str(30 * 24 * 3600)))
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "50000"))
+
+# Background coding jobs: state in SQLite, submitted PDFs spooled to disk until the job ends;
+# finished jobs (and their result rows) are purged JOB_TTL_S after their last update
+JOB_DB_PATH = os.getenv("JOB_DB_PATH", ".cache/jobs.sqlite3")
+JOB_SPOOL_DIR = os.getenv("JOB_SPOOL_DIR", ".cache/jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_TTL_S = float(os.getenv("JOB_TTL_S", str(7 * 24 * 3600)))
+JOB_POLL_S = float(os.getenv("JOB_POLL_S", "2"))
+
+# PDF text extraction: pypdf | pymupdf (optional, `pip install pymupdf`; falls back to pypdf
+# when it is not installed). Text layout differs slightly between backends.
+PDF_BACKEND = os.getenv("PDF_BACKEND", "pypdf")
+# Files with at least this many pages are split into page ranges across the PDF worker
+# processes (0 disables); each task extracts PDF_PAGES_PER_TASK pages
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "10"))
+# Extracted text per PDF content hash and backend, so re-runs skip parsing. Off by default
+# because it holds raw, not de-identified, note text (PHI); set a directory to enable it.
+# Files older than PDF_TEXT_CACHE_TTL_S are pruned at the start of every batch
+PDF_TEXT_CACHE_DIR = os.getenv("PDF_TEXT_CACHE_DIR", "")
+PDF_TEXT_CACHE_TTL_S = float(os.getenv("PDF_TEXT_CACHE_TTL_S", str(7 * 24 * 3600)))
+
+# Uploads from non-seekable streams are buffered in memory up to this size, then spill to an anonymous temp file
+PDF_SPILL_THRESHOLD_BYTES = int(os.getenv("PDF_SPILL_THRESHOLD_BYTES", str(20 * 1024 * 1024)))
+
+# Excel exports with at least this many rows are written with a streaming write-only workbook
+EXPORT_STREAMING_ROWS = int(os.getenv("EXPORT_STREAMING_ROWS", "5000"))
+
+# Per-note stage traces (JSON lines); set TRACE_PATH="" to keep traces in memory only
+TRACE_ENABLED = os.getenv("TRACE_ENABLED", "1") == "1"
+TRACE_PATH = os.getenv("TRACE_PATH", ".cache/traces.jsonl")
@@ -0,0 +1,136 @@
+import json
+import os
+import time
+import numpy as np
+from typing import Optional, Tuple
+from config import ANN_BACKEND, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH
+## Approximate nearest-neighbour index over the rows of an IcdEmbeddingStore.
+## Scores are inner products of L2-normalized vectors (cosine similarity).
+## hnswlib and faiss are optional; "exact" scans the matrix with numpy.
+
+ANN_BACKENDS = ("hnswlib", "faiss", "exact")
+
+
+class IcdAnnIndex:
+    """
+    Row index -> vector ANN index. search() returns store rows, so results
+    plug straight into rank_icd_rows_batch.
+    """
+
+    META_FILE = "ann.json"
+    INDEX_FILES = {"hnswlib": "hnsw.bin", "faiss": "faiss.index"}
+
+    def __init__(self, backend: str, index, matrix: np.ndarray, build_s: float = 0.0):
+        self.backend = backend
+        self.index = index
+        self.matrix = matrix
+        self.build_s = build_s
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, backend: str = ANN_BACKEND,
+              m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+              ef_search: int = HNSW_EF_SEARCH) -> "IcdAnnIndex":
+        if backend not in ANN_BACKENDS:
+            raise ValueError(f"Unknown ANN backend {backend!r}; expected one of {ANN_BACKENDS}")
+        start = time.perf_counter()
+        vectors = np.ascontiguousarray(matrix, dtype=np.float32)
+        n, dim = vectors.shape
+        index = None
+        if backend == "hnswlib":
+            import hnswlib
+            index = hnswlib.Index(space="ip", dim=dim)
+            index.init_index(max_elements=max(1, n), ef_construction=ef_construction, M=m)
+            index.add_items(vectors, np.arange(n), num_threads=-1)
+            index.set_ef(ef_search)
+        elif backend == "faiss":
+            import faiss
+            index = faiss.IndexHNSWFlat(dim, m, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efConstruction = ef_construction
+            index.add(vectors)
+            index.hnsw.efSearch = ef_search
+        return cls(backend, index, matrix, time.perf_counter() - start)
+
+    def search(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k (rows, scores) per query row, best first."""
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        k = min(k, len(self))
+        if k <= 0:
+            empty = np.zeros((len(queries), 0))
+            return empty.astype(np.int64), empty.astype(np.float32)
+        if self.backend == "hnswlib":
+            # ef must be at least k for hnswlib to return k results
+            self.index.set_ef(max(k, self.index.ef))
+            labels, distances = self.index.knn_query(queries, k=k)
+            return labels.astype(np.int64), (1.0 - distances).astype(np.float32)
+        if self.backend == "faiss":
+            scores, labels = self.index.search(queries, k)
+            return labels.astype(np.int64), scores.astype(np.float32)
+        sims = queries @ self.matrix.T
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(sims, top, axis=1), axis=1)
+        rows = np.take_along_axis(top, order, axis=1)
+        return rows.astype(np.int64), np.take_along_axis(sims, rows, axis=1).astype(np.float32)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        if self.backend in self.INDEX_FILES:
+            path = os.path.join(directory, self.INDEX_FILES[self.backend])
+            tmp_path = f"{path}.tmp"
+            if self.backend == "hnswlib":
+                self.index.save_index(tmp_path)
+            else:
+                import faiss
+                faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, path)
+        with open(os.path.join(directory, self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"backend": self.backend, "count": len(self), "build_s": self.build_s}, f)
+
+    @classmethod
+    def load(cls, directory: str, matrix: np.ndarray, backend: str = ANN_BACKEND) -> Optional["IcdAnnIndex"]:
+        meta_path = os.path.join(directory, cls.META_FILE)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["backend"] != backend or meta["count"] != matrix.shape[0]:
+            return None
+        index = None
+        if backend == "hnswlib":
+            import hnswlib
+            index = hnswlib.Index(space="ip", dim=matrix.shape[1])
+            index.load_index(os.path.join(directory, cls.INDEX_FILES[backend]), max_elements=meta["count"])
+            index.set_ef(HNSW_EF_SEARCH)
+        elif backend == "faiss":
+            import faiss
+            index = faiss.read_index(os.path.join(directory, cls.INDEX_FILES[backend]))
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        return cls(backend, index, matrix, meta.get("build_s", 0.0))
+
+    def nbytes(self, directory: Optional[str] = None) -> int:
+        """Approximate memory held by the index itself (the persisted file size), excluding the store matrix."""
+        if self.backend in self.INDEX_FILES and directory:
+            path = os.path.join(directory, self.INDEX_FILES[self.backend])
+            if os.path.exists(path):
+                return os.path.getsize(path)
+        if self.backend == "hnswlib":
+            # vectors + level-0 links + label, per element
+            return len(self) * (self.matrix.shape[1] * 4 + HNSW_M * 2 * 4 + 16)
+        if self.backend == "faiss":
+            return len(self) * (self.matrix.shape[1] * 4 + HNSW_M * 2 * 8)
+        return 0
+
+
+def load_or_build_ann(matrix: np.ndarray, directory: Optional[str] = None,
+                      backend: str = ANN_BACKEND) -> IcdAnnIndex:
+    """ANN index for matrix, loaded from / persisted to directory when given."""
+    if directory:
+        cached = IcdAnnIndex.load(directory, matrix, backend)
+        if cached is not None:
+            return cached
+    ann = IcdAnnIndex.build(matrix, backend)
+    if directory:
+        ann.save(directory)
+    return ann
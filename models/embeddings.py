@@ -1,87 +1,480 @@
-from sentence_transformers import SentenceTransformer, CrossEncoder
 import numpy as np
-from typing import List, Dict, Any
+import gc
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import List, Dict, Any, Optional
+from utils.tracing import tracer
+from models.ann_index import load_or_build_ann
+from config import (
+    EMBED_MODEL_NAME,
+    CROSS_ENCODER_MODEL_NAME,
+    EMBED_BACKEND,
+    CROSS_ENCODER_BACKEND,
+    ONNX_QUANTIZATION,
+    ONNX_EXPORT_DIR,
+    NOTE_CHUNKING,
+    NOTE_CHUNK_WORDS,
+    NOTE_CHUNK_OVERLAP_WORDS,
+    NOTE_CHUNK_POOLING,
+    CROSS_ENCODER_WINDOWS,
+    ANN_BACKEND,
+    ANN_CANDIDATES,
+    ANN_CPT_FILTER,
+    HNSW_M,
+    HNSW_EF_CONSTRUCTION,
+    MODEL_DEVICE,
+    MODEL_NUM_THREADS,
+)
 ## This file only contains embedding logic, ICD store builder, and rerank function.
+## sentence_transformers (and torch) are imported on first model load, not at import.
+
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+def _onnx_int8_path(model_name: str) -> str:
+    """Local copy of model_name with an int8 ONNX export next to the fp32 one."""
+    return os.path.join(ONNX_EXPORT_DIR, model_name.replace("/", "__"))
+
+
+def load_model(cls, model_name: str, backend: str = "torch", device: str = "cpu"):
+    """
+    Build a SentenceTransformer / CrossEncoder on the requested backend:
+
+    - torch:      fp32 PyTorch (the reference)
+    - torch-int8: PyTorch with Linear layers dynamically quantized to int8 (CPU only)
+    - onnx:       ONNX Runtime, fp32 graph exported on first load
+    - onnx-int8:  ONNX Runtime with a dynamically quantized int8 graph, exported
+                  once into ONNX_EXPORT_DIR and reused afterwards
+
+    The ONNX backends need `pip install sentence-transformers[onnx]`.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}; expected one of {BACKENDS}")
+
+    if backend == "torch":
+        return cls(model_name, device=device)
+
+    if backend == "torch-int8":
+        import torch
+        model = cls(model_name, device="cpu")
+        torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        return model
+
+    if backend == "onnx":
+        return cls(model_name, device=device, backend="onnx")
+
+    from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+    local_path = _onnx_int8_path(model_name)
+    file_name = f"onnx/model_qint8_{ONNX_QUANTIZATION}.onnx"
+    if not os.path.exists(os.path.join(local_path, file_name)):
+        model = cls(model_name, device=device, backend="onnx")
+        model.save_pretrained(local_path)
+        export_dynamic_quantized_onnx_model(model, ONNX_QUANTIZATION, local_path)
+    return cls(local_path, device=device, backend="onnx", model_kwargs={"file_name": file_name})
+
+
+def _load_embedder(device: str):
+    from sentence_transformers import SentenceTransformer
+    return load_model(SentenceTransformer, EMBED_MODEL_NAME, EMBED_BACKEND, device)
+
+
+def _load_cross_encoder(device: str):
+    from sentence_transformers import CrossEncoder
+    return load_model(CrossEncoder, CROSS_ENCODER_MODEL_NAME, CROSS_ENCODER_BACKEND, device)
+
+
+class ModelRegistry:
+    """
+    Process-wide registry of the embedding and reranking models.
+    Models are created on first use and shared across notes and sessions.
+    """
+
+    def __init__(self, device: Optional[str] = None, num_threads: Optional[int] = None):
+        self.device = device or MODEL_DEVICE
+        self.num_threads = MODEL_NUM_THREADS if num_threads is None else num_threads
+        self._models: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._loaders = {
+            "embedder": lambda: _load_embedder(self.device),
+            "cross_encoder": lambda: _load_cross_encoder(self.device),
+        }
+
+    def _apply_threads(self):
+        if self.num_threads > 0:
+            import torch
+            torch.set_num_threads(self.num_threads)
+
+    def get(self, name: str):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        with self._lock:
+            if name not in self._models:
+                if name not in self._loaders:
+                    raise KeyError(f"Unknown model: {name}")
+                self._apply_threads()
+                self._models[name] = self._loaders[name]()
+            return self._models[name]
+
+    def embedder(self):
+        return self.get("embedder")
+
+    def cross_encoder(self):
+        return self.get("cross_encoder")
+
+    def register(self, name: str, model):
+        """Install an already-built model (e.g. a stub for benchmarks) under name."""
+        with self._lock:
+            self._models[name] = model
+
+    def is_loaded(self, name: str) -> bool:
+        return name in self._models
+
+    def warm_up(self, names=("embedder", "cross_encoder")):
+        """Load the given models and run one tiny inference so first real calls are fast."""
+        for name in names:
+            model = self.get(name)
+            if name == "embedder":
+                model.encode(["warm up"], convert_to_numpy=True, show_progress_bar=False)
+            elif name == "cross_encoder":
+                model.predict([("warm up", "warm up")], show_progress_bar=False)
+
+    def evict(self, name: Optional[str] = None):
+        """Unload one model (or all models when name is None) and release its memory."""
+        with self._lock:
+            names = [name] if name else list(self._models)
+            for n in names:
+                self._models.pop(n, None)
+        gc.collect()
+        if self.device.startswith("cuda"):
+            import torch
+            torch.cuda.empty_cache()
+
+
+registry = ModelRegistry()
 
-# Load MedEmbed model once (cached)
-embedder = SentenceTransformer("abhinand/MedEmbed-large-v0.1")
 
 def embed_texts(texts: List[str]) -> np.ndarray:
     """Return L2-normalized embeddings as numpy arrays."""
-    embs = embedder.encode(
-        texts,
-        convert_to_numpy=True,
-        batch_size=32,
-        normalize_embeddings=True,
-        show_progress_bar=False
-    )
+    with tracer.span("embed_texts", batch_size=len(texts)):
+        embs = registry.embedder().encode(
+            texts,
+            convert_to_numpy=True,
+            batch_size=32,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
     return embs
 
-def build_icd_embedding_store(mapping_df, embed_fn):
+
+def chunk_text(text: str, window: int = NOTE_CHUNK_WORDS, overlap: int = NOTE_CHUNK_OVERLAP_WORDS) -> List[str]:
+    """Split text into windows of `window` words, consecutive windows sharing `overlap` words."""
+    words = text.split()
+    if len(words) <= window:
+        return [" ".join(words)]
+    step = max(1, window - overlap)
+    starts = range(0, len(words) - overlap, step)
+    return [" ".join(words[i:i + window]) for i in starts]
+
+
+def embed_notes(texts: List[str], chunked: bool = NOTE_CHUNKING) -> List[np.ndarray]:
     """
-    Precompute embeddings for ICD codes/descriptions.
-    Returns: dict[str, np.ndarray]
+    One embedding per note for rank_icds_batch. With chunking, each
+    entry is a (windows, dim) matrix; the windows of all notes are encoded in
+    a single embed_texts call.
     """
-    icd_store = {}
-    for _, row in mapping_df.iterrows():
-        key = f"{row['ICD-10 Code']}: {row['ICD-10 Description']}"
-        if key not in icd_store:
-            icd_store[key] = embed_fn([key])[0]
-    return icd_store
+    if not chunked:
+        return list(embed_texts(texts))
+    windows = [chunk_text(t) for t in texts]
+    flat = embed_texts([w for ws in windows for w in ws])
+    bounds = np.cumsum([0] + [len(ws) for ws in windows])
+    return [flat[bounds[i]:bounds[i + 1]] for i in range(len(texts))]
 
-# ICD_STORE should be initialized in app.py and passed in if needed
 
-def rerank_icd_candidates(note_text: str,
-                          icd_candidates: List[Dict[str, str]],
-                          icd_store: Dict[str, np.ndarray],
-                          top_k: int = 5,
-                          rerank_with_cross_encoder: bool = True) -> List[Dict[str, Any]]:
+class IcdEmbeddingStore:
     """
-    Re-rank ICD candidates:
-      1. Fast filter with embeddings (MedEmbed bi-encoder + ICD_STORE lookup).
-      2. Optional cross-encoder rerank for top-K.
+    ICD embeddings as one contiguous float32 matrix plus a key -> row index.
+    Keys are "{icd}: {description}" strings.
     """
-    cross_encoder = CrossEncoder("cross-encoder/ms-marco-MiniLM-L-6-v2")
 
-    if not icd_candidates:
-        return []
+    MATRIX_FILE = "embeddings.npy"
+    INDEX_FILE = "index.json"
+
+    def __init__(self, keys: List[str], matrix: np.ndarray):
+        self.keys = list(keys)
+        self.matrix = matrix
+        split = [k.split(": ", 1) for k in self.keys]
+        self.codes = [parts[0] for parts in split]
+        self.descriptions = [parts[-1] for parts in split]
+        self._index: Optional[Dict[str, int]] = None
+        self._categories: Optional[np.ndarray] = None
+        # CPT -> candidate rows, the optional ANN index and the persisted cache
+        # directory, attached by build_icd_embedding_store
+        self.cpt_index: Optional["CptIcdIndex"] = None
+        self.ann = None
+        self.cache_dir: Optional[str] = None
+
+    @property
+    def index(self) -> Dict[str, int]:
+        """key -> row, built on first key lookup (row-based callers never need it)."""
+        if self._index is None:
+            self._index = {k: i for i, k in enumerate(self.keys)}
+        return self._index
+
+    @property
+    def categories(self) -> np.ndarray:
+        """3-character ICD-10 category of every row, e.g. "F41" for F41.1."""
+        if self._categories is None:
+            self._categories = np.array([c[:3] for c in self.codes])
+        return self._categories
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key) -> np.ndarray:
+        return self.matrix[self.index[key]]
+
+    def rows(self, keys: List[str]) -> np.ndarray:
+        return np.fromiter((self.index[k] for k in keys), dtype=np.int64, count=len(keys))
+
+    def save(self, directory: str):
+        os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(directory)))
+        np.save(os.path.join(tmp_dir, self.MATRIX_FILE), self.matrix)
+        with open(os.path.join(tmp_dir, self.INDEX_FILE), "w", encoding="utf-8") as f:
+            json.dump({"keys": self.keys}, f)
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # Another process already persisted the same store
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> Optional["IcdEmbeddingStore"]:
+        matrix_path = os.path.join(directory, cls.MATRIX_FILE)
+        index_path = os.path.join(directory, cls.INDEX_FILE)
+        if not (os.path.exists(matrix_path) and os.path.exists(index_path)):
+            return None
+        with open(index_path, encoding="utf-8") as f:
+            keys = json.load(f)["keys"]
+        matrix = np.load(matrix_path, mmap_mode="r" if mmap else None)
+        if matrix.shape[0] != len(keys):
+            return None
+        return cls(keys, matrix)
+
+
+def icd_store_keys(mapping_df) -> List[str]:
+    """Unique "{icd}: {description}" keys in first-seen order."""
+    keys = mapping_df["ICD-10 Code"].astype(str) + ": " + mapping_df["ICD-10 Description"].astype(str)
+    return list(dict.fromkeys(keys))
+
+
+class CptIcdIndex:
+    """
+    CPT -> int64 array of candidate rows in an IcdEmbeddingStore, built once
+    from the mapping sheet. Deduplicated unions for CPT combinations are
+    cached, so a note's candidate set is a single dict lookup.
+    """
+
+    def __init__(self, cpt_rows: Dict[str, np.ndarray]):
+        self.cpt_rows = cpt_rows
+        self._unions: Dict[tuple, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_mapping(cls, mapping_df, icd_store: IcdEmbeddingStore) -> "CptIcdIndex":
+        keys = mapping_df["ICD-10 Code"].astype(str) + ": " + mapping_df["ICD-10 Description"].astype(str)
+        rows = icd_store.rows(list(keys))
+        by_cpt: Dict[str, Dict[int, None]] = {}
+        for cpt, row in zip(mapping_df["CPT"].astype(str).str.strip(), rows.tolist()):
+            by_cpt.setdefault(cpt, {})[row] = None
+        return cls({cpt: np.fromiter(r, dtype=np.int64, count=len(r)) for cpt, r in by_cpt.items()})
+
+    def __contains__(self, cpt) -> bool:
+        return cpt in self.cpt_rows
 
-    normalized_icds = []
-    for c in icd_candidates:
-        if "icd" in c and "description" in c:
-            normalized_icds.append({"icd": c["icd"], "description": c["description"]})
+    def candidates(self, cpts: List[str]) -> np.ndarray:
+        """Unique candidate rows for the given CPTs, in first-seen order; unknown CPTs are ignored."""
+        key = tuple(dict.fromkeys(cpts))
+        rows = self._unions.get(key)
+        if rows is None:
+            parts = [self.cpt_rows[c] for c in key if c in self.cpt_rows]
+            rows = np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+            _, first = np.unique(rows, return_index=True)
+            rows = rows[np.sort(first)]
+            with self._lock:
+                self._unions[key] = rows
+        return rows
+
+
+def build_icd_embedding_store(mapping_df, embed_fn, cache_dir: Optional[str] = None,
+                              icd10cm_df=None, ann_backend: str = ANN_BACKEND) -> IcdEmbeddingStore:
+    """
+    Precompute embeddings for ICD codes/descriptions in one batched call.
+    When cache_dir is given the store is loaded from (or persisted to) disk.
+    The store's cpt_index is always rebuilt from mapping_df. With icd10cm_df
+    (the full code set) those codes are added to the store and an ANN index
+    over all rows is attached as store.ann.
+    """
+    store = IcdEmbeddingStore.load(cache_dir) if cache_dir else None
+    if store is None:
+        keys = icd_store_keys(mapping_df)
+        if icd10cm_df is not None:
+            keys = list(dict.fromkeys(keys + icd_store_keys(icd10cm_df)))
+        if keys:
+            matrix = np.ascontiguousarray(embed_fn(keys), dtype=np.float32)
         else:
-            icd, desc = list(c.items())[0]
-            normalized_icds.append({"icd": icd, "description": desc})
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        store = IcdEmbeddingStore(keys, matrix)
+        if cache_dir:
+            store.save(cache_dir)
 
-    note_emb = embed_texts([note_text])[0]
-    icd_texts = [f'{c["icd"]}: {c["description"]}' for c in normalized_icds]
-    icd_embs = np.array([icd_store[txt] for txt in icd_texts])
+    store.cpt_index = CptIcdIndex.from_mapping(mapping_df, store)
+    store.cache_dir = cache_dir
+    if icd10cm_df is not None:
+        ann_dir = None
+        if cache_dir:
+            ann_dir = os.path.join(cache_dir, f"ann-{ann_backend}-m{HNSW_M}-efc{HNSW_EF_CONSTRUCTION}")
+        store.ann = load_or_build_ann(store.matrix, ann_dir, ann_backend)
+    return store
 
-    sims = note_emb @ icd_embs.T
-    idxs = np.argsort(-sims)[: min(top_k * 3, len(normalized_icds))]
 
-    preselected = [
-        {
-            "icd": normalized_icds[i]["icd"],
-            "description": normalized_icds[i]["description"],
-            "score": float(sims[i]),
-        }
-        for i in idxs
+def icd_candidate_rows(icd_store: IcdEmbeddingStore, cpts: List[str],
+                       note_emb: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Candidate rows for a note: the mapping sheet's ICDs for cpts, plus, when
+    the store has an ANN index, the note's nearest codes (ANN_CANDIDATES per
+    window) post-filtered to the categories of those CPT-allowed ICDs
+    (ANN_CPT_FILTER).
+    """
+    allowed = icd_store.cpt_index.candidates(cpts)
+    if icd_store.ann is None or note_emb is None:
+        return allowed
+    with tracer.span("ann_search", backend=icd_store.ann.backend):
+        hits, _ = icd_store.ann.search(note_emb, ANN_CANDIDATES)
+    hits = np.unique(hits)
+    if ANN_CPT_FILTER == "category":
+        hits = hits[np.isin(icd_store.categories[hits], icd_store.categories[allowed])]
+    return np.concatenate([allowed, np.setdiff1d(hits, allowed, assume_unique=True)])
+
+def rank_icds_batch(note_texts: List[str],
+                    cpts_per_note: List[List[str]],
+                    icd_store: IcdEmbeddingStore,
+                    top_k: int = 5,
+                    rerank_with_cross_encoder: bool = True,
+                    note_embs: Optional[List[np.ndarray]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Rank, for each note, the ICDs allowed for its CPTs (see
+    icd_candidate_rows); all notes are scored together.
+    """
+    if note_embs is None and icd_store.ann is not None:
+        note_embs = embed_notes(note_texts)
+    rows_per_note = [
+        icd_candidate_rows(icd_store, cpts, None if note_embs is None else emb)
+        for cpts, emb in zip(cpts_per_note, note_embs or [None] * len(note_texts))
     ]
+    return rank_icd_rows_batch(
+        note_texts, rows_per_note, icd_store, top_k, rerank_with_cross_encoder, note_embs
+    )
+
+
+def rank_icd_rows_batch(note_texts: List[str],
+                        rows_per_note: List[np.ndarray],
+                        icd_store: IcdEmbeddingStore,
+                        top_k: int = 5,
+                        rerank_with_cross_encoder: bool = True,
+                        note_embs: Optional[List[np.ndarray]] = None) -> List[List[Dict[str, Any]]]:
+    """
+    Re-rank ICD candidates (rows of icd_store) for several notes at once:
+      1. Fast filter with embeddings (MedEmbed bi-encoder + ICD_STORE lookup):
+         every note window against the union of all candidates in one matrix
+         product, masked to each note's own candidates.
+      2. Optional cross-encoder rerank for top-K, one predict call for all notes.
+    Candidate vectors always come from the precomputed store; notes without
+    note_embs (from embed_notes) are embedded in one call. A 2-D note
+    embedding holds one row per chunk_text window: similarities are pooled
+    over windows and each candidate is cross-scored against its best-matching
+    windows only.
+    """
+    results: List[List[Dict[str, Any]]] = [[] for _ in note_texts]
+    active = [i for i, rows in enumerate(rows_per_note) if len(rows)]
+    if not active:
+        return results
+
+    if note_embs is None:
+        embs = embed_notes([note_texts[i] for i in active])
+    else:
+        embs = [note_embs[i] for i in active]
+    windows_embs = [np.atleast_2d(e) for e in embs]
+    counts = np.array([len(w) for w in windows_embs])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    union = np.unique(np.concatenate([rows_per_note[i] for i in active]))
+    window_sims = np.vstack(windows_embs) @ icd_store.matrix[union].T
+    if NOTE_CHUNK_POOLING == "mean":
+        sims = np.add.reduceat(window_sims, offsets, axis=0) / counts[:, None]
+    else:
+        sims = np.maximum.reduceat(window_sims, offsets, axis=0)
+
+    mask = np.zeros(sims.shape, dtype=bool)
+    for a, i in enumerate(active):
+        mask[a, np.searchsorted(union, rows_per_note[i])] = True
+    sims = np.where(mask, sims, -np.inf)
 
-    if rerank_with_cross_encoder and preselected:
-        pairs = [(note_text, f"{p['icd']}: {p['description']}") for p in preselected]
-        cross_scores = cross_encoder.predict(pairs)
-        for p, cs in zip(preselected, cross_scores):
-            p["cross_score"] = float(cs)
-        preselected = sorted(preselected, key=lambda x: -x["cross_score"])
+    n_per_note = [min(top_k * 3, len(rows_per_note[i])) for i in active]
+    n_max = max(n_per_note)
+    if n_max < len(union):
+        top = np.argpartition(-sims, n_max - 1, axis=1)[:, :n_max]
+    else:
+        top = np.broadcast_to(np.arange(len(union)), (len(active), len(union)))
 
-    unique_ranked = {}
-    for r in preselected[:top_k]:
-        icd = r["icd"]
-        if icd not in unique_ranked or r.get("cross_score", r["score"]) > unique_ranked[icd].get("cross_score", r["score"]):
-            unique_ranked[icd] = r
+    preselected, pairs, n_windows = [], [], []
+    for a, i in enumerate(active):
+        # Everything tied with the cut-off stays in play; ties are broken by row
+        cutoff = sims[a, top[a]].min()
+        idxs = np.flatnonzero((sims[a] >= cutoff) & mask[a])
+        idxs = idxs[np.lexsort((idxs, -sims[a, idxs]))][: n_per_note[a]]
+        rows = union[idxs]
+        preselected.append([
+            {
+                "icd": icd_store.codes[row],
+                "description": icd_store.descriptions[row],
+                "score": float(sims[a, j]),
+            }
+            for row, j in zip(rows, idxs)
+        ])
+        if rerank_with_cross_encoder:
+            note_window_sims = window_sims[offsets[a]:offsets[a] + counts[a]]
+            windows = chunk_text(note_texts[i]) if counts[a] > 1 else [note_texts[i]]
+            n_windows.append(min(max(1, CROSS_ENCODER_WINDOWS), len(windows)))
+            for row, j in zip(rows, idxs):
+                best = np.argsort(-note_window_sims[:, j])[: n_windows[a]]
+                pairs.extend((windows[w], icd_store.keys[row]) for w in best)
 
-    return sorted(unique_ranked.values(), key=lambda x: -(x.get("cross_score", x["score"])))
+    if pairs:
+        with tracer.span("cross_encoder", batch_size=len(pairs), notes=len(active)):
+            cross_scores = np.asarray(registry.cross_encoder().predict(pairs), dtype=np.float32)
+        start = 0
+        for a, candidates in enumerate(preselected):
+            end = start + len(candidates) * n_windows[a]
+            note_scores = cross_scores[start:end].reshape(len(candidates), n_windows[a])
+            for p, cs in zip(candidates, note_scores.max(axis=1)):
+                p["cross_score"] = float(cs)
+            candidates.sort(key=lambda x: -x["cross_score"])
+            start = end
 
+    for i, candidates in zip(active, preselected):
+        unique_ranked = {}
+        for r in candidates[:top_k]:
+            icd = r["icd"]
+            if icd not in unique_ranked or r.get("cross_score", r["score"]) > unique_ranked[icd].get("cross_score", r["score"]):
+                unique_ranked[icd] = r
+        results[i] = sorted(unique_ranked.values(), key=lambda x: -(x.get("cross_score", x["score"])))
+    return results
@@ -0,0 +1,66 @@
+import hashlib
+import re
+import time
+import numpy as np
+from typing import List, Sequence, Tuple
+
+_TOKEN_RE = re.compile(r"[a-z0-9.]+")
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class FakeEmbedder:
+    """
+    Deterministic hashing-trick stand-in for the MedEmbed SentenceTransformer.
+    latency_per_text simulates encoder cost so batching effects stay visible.
+    """
+
+    def __init__(self, dim: int = 256, latency_per_text: float = 0.0):
+        self.dim = dim
+        self.latency_per_text = latency_per_text
+
+    def _vector(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for tok in _tokens(text):
+            h = int.from_bytes(hashlib.blake2b(tok.encode(), digest_size=4).digest(), "little")
+            vec[h % self.dim] += 1.0 if h & 1 else -1.0
+        return vec
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=32,
+               normalize_embeddings=True, show_progress_bar=False):
+        if isinstance(texts, str):
+            texts = [texts]
+        if self.latency_per_text:
+            time.sleep(self.latency_per_text * len(texts))
+        embs = np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(embs, axis=1, keepdims=True)
+            embs = embs / np.where(norms == 0, 1, norms)
+        return embs
+
+
+class FakeCrossEncoder:
+    """Token-overlap stand-in for the MiniLM cross-encoder."""
+
+    def __init__(self, latency_per_pair: float = 0.0):
+        self.latency_per_pair = latency_per_pair
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], batch_size=32, show_progress_bar=False):
+        if self.latency_per_pair:
+            time.sleep(self.latency_per_pair * len(pairs))
+        scores = []
+        for query, doc in pairs:
+            q, d = set(_tokens(query)), set(_tokens(doc))
+            scores.append(len(q & d) / (len(d) or 1))
+        return np.array(scores, dtype=np.float32)
+
+
+def install_fake_encoders(embed_latency: float = 0.0, cross_latency: float = 0.0):
+    """Register deterministic fakes in models.embeddings.registry."""
+    from models.embeddings import registry
+
+    registry.register("embedder", FakeEmbedder(latency_per_text=embed_latency))
+    registry.register("cross_encoder", FakeCrossEncoder(latency_per_pair=cross_latency))
+    return registry
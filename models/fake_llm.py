@@ -0,0 +1,105 @@
+import asyncio
+import re
+import threading
+import time
+from typing import Callable, List, Optional, Sequence
+
+
+class FakeRateLimitError(Exception):
+    """Mimics a Gemini 429 so retry/backoff paths can be exercised offline."""
+
+    code = 429
+
+
+def _fake_cpt(note: str) -> dict:
+    note = note.lower()
+    if "crisis" in note:
+        return {"CPT": ["90839"]}
+    if "diagnostic evaluation" in note or "initial assessment" in note:
+        return {"CPT": ["90791"]}
+    match = re.search(r"duration:\s*(\d+)", note)
+    if match and int(match.group(1)) < 53:
+        return {"CPT": ["90832"]}
+    return {"CPT": ["90837"]}
+
+
+def fake_cpt_response(prompt: str) -> dict:
+    """Pick a CPT from duration/keyword cues in the note, deterministically."""
+    # Only look at the note itself, not the examples in cpt_prediction_prompt
+    note = prompt.split("in the specified JSON format:", 1)[-1]
+    return _fake_cpt(note.rsplit("Return the result in this JSON format", 1)[0])
+
+
+def fake_icd_response(prompt: str) -> dict:
+    """Return the first two codes from the allowed ICD block."""
+    block = prompt.split("Allowed ICDs:", 1)[-1]
+    codes = re.findall(r"^- (\S+) —", block, re.MULTILINE)
+    return {"ICD10": codes[:2]}
+
+
+def fake_coding_response(prompt: str) -> dict:
+    """fake_cpt_response + fake_icd_response for the combined coding prompt."""
+    note = prompt.split("Clinical note:", 1)[-1].rsplit("Allowed ICDs:", 1)[0]
+    return {**_fake_cpt(note), **fake_icd_response(prompt)}
+
+
+class FakeStructuredLLM:
+    """
+    Local stand-in for `llm.with_structured_output(schema)`: same invoke /
+    ainvoke / abatch surface, configurable latency and injected 429s.
+    """
+
+    def __init__(self, schema, respond: Callable[[str], dict],
+                 latency: float = 0.0, fail_every: int = 0):
+        self.schema = schema
+        self.respond = respond
+        self.latency = latency
+        self.fail_every = fail_every
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next(self, prompt):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        if self.fail_every and calls % self.fail_every == 0:
+            raise FakeRateLimitError("429 ResourceExhausted (fake)")
+        return self.schema(**self.respond(str(prompt)))
+
+    def invoke(self, prompt, config=None):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._next(prompt)
+
+    async def ainvoke(self, prompt, config=None):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._next(prompt)
+
+    async def abatch(self, prompts: Sequence, config=None, return_exceptions: bool = False) -> List:
+        async def one(prompt):
+            try:
+                return await self.ainvoke(prompt)
+            except Exception as exc:
+                if return_exceptions:
+                    return exc
+                raise
+        return list(await asyncio.gather(*(one(p) for p in prompts)))
+
+
+def install_fake_llm(latency: float = 0.0, fail_every: int = 0,
+                     cpt_respond: Optional[Callable[[str], dict]] = None,
+                     icd_respond: Optional[Callable[[str], dict]] = None):
+    """Swap the Gemini runnables behind models.llm for deterministic fakes."""
+    from models import llm
+
+    llm.structured_llm.runnable = FakeStructuredLLM(
+        llm.CPT_Output, cpt_respond or fake_cpt_response, latency, fail_every
+    )
+    llm.icd_structured_llm.runnable = FakeStructuredLLM(
+        llm.ICD_Output, icd_respond or fake_icd_response, latency, fail_every
+    )
+    llm.coding_structured_llm.runnable = FakeStructuredLLM(
+        llm.Coding_Output, fake_coding_response, latency, fail_every
+    )
+    return llm.structured_llm, llm.icd_structured_llm
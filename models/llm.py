@@ -1,20 +1,228 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
 from pydantic import BaseModel, Field
-from typing import List, Annotated
-from dotenv import load_dotenv
-import os
-load_dotenv()
-
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    google_api_key=os.getenv("GOOGLE_API_KEY"),
+from typing import List, Annotated, Any, Optional, Sequence
+import asyncio
+import random
+import threading
+import time
+from functools import lru_cache
+from utils.tracing import tracer, NULL_SPAN
+from config import (
+    GOOGLE_API_KEY,
+    LLM_MODEL_NAME,
+    LLM_RATE_PER_SEC,
+    LLM_BURST,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_TIMEOUT_S,
 )
 
+
+@lru_cache(maxsize=None)
+def get_llm():
+    """Gemini chat client, built (and langchain_google_genai imported) on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL_NAME,
+        google_api_key=GOOGLE_API_KEY,
+        timeout=LLM_TIMEOUT_S,
+        # Retries are handled by RateLimitedLLM so they share the rate limiter
+        max_retries=0,
+    )
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket shared by sync and async callers.
+    Tokens may go negative: each caller reserves its slot and sleeps for the debt.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, n: int = 1) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, n: int = 1):
+        wait = self._reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, n: int = 1):
+        wait = self._reserve(n)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class LLMLoop:
+    """
+    One long-lived event loop, on a daemon thread, that runs every LLM call.
+    Callers may come from many threads, each with its own short-lived loop
+    (asyncio.run in the pipeline's coding threads and the job workers);
+    sending the calls here keeps RateLimitedLLM's concurrency limit global
+    and the chat client's async transport on the loop that created it.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True).start()
+                self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """Run coro on the LLM loop and block for its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def arun(self, coro):
+        """Await coro on the LLM loop from any other loop (or directly when already on it)."""
+        loop = self.loop
+        if asyncio.get_running_loop() is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+
+llm_loop = LLMLoop()
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, 429s and 5xx responses are worth retrying; bad requests are not."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    code = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    if isinstance(code, int):
+        return code == 429 or code >= 500
+    message = str(exc)
+    return any(s in message for s in ("429", "ResourceExhausted", "RESOURCE_EXHAUSTED", "503", "UNAVAILABLE", "DeadlineExceeded"))
+
+
+class RateLimitedLLM:
+    """
+    Wraps a structured-output runnable with a token-bucket rate limiter,
+    bounded concurrency, per-call timeouts and retries with full jitter.
+    Every call runs on llm_loop, so max_concurrency holds across all
+    threads and event loops of the process.
+    Exposes invoke / ainvoke / abatch like the wrapped runnable. Runnables
+    built with include_raw=True are unwrapped to the parsed object and their
+    token usage is recorded on the current trace span. Pass factory instead
+    of runnable to build the runnable on first use.
+    """
+
+    def __init__(self, runnable=None, bucket: TokenBucket = None, name: str = "llm",
+                 factory=None,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 max_retries: int = LLM_MAX_RETRIES,
+                 timeout: float = LLM_TIMEOUT_S,
+                 backoff_base: float = 1.0,
+                 backoff_cap: float = 30.0):
+        self._runnable = runnable
+        self._factory = factory
+        self._runnable_lock = threading.Lock()
+        self.bucket = bucket or TokenBucket(0, 1)
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # Only ever awaited on llm_loop
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    @property
+    def runnable(self):
+        if self._runnable is None:
+            with self._runnable_lock:
+                if self._runnable is None:
+                    self._runnable = self._factory()
+        return self._runnable
+
+    @runnable.setter
+    def runnable(self, value):
+        self._runnable = value
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def _unwrap(result, span=NULL_SPAN):
+        if isinstance(result, dict) and "parsed" in result:
+            usage = getattr(result.get("raw"), "usage_metadata", None) or {}
+            span.incr("input_tokens", usage.get("input_tokens", 0))
+            span.incr("output_tokens", usage.get("output_tokens", 0))
+            if result.get("parsing_error") is not None:
+                raise result["parsing_error"]
+            return result["parsed"]
+        return result
+
+    async def _acall(self, prompt: Any, span):
+        """
+        One call with its own timeout and retries; attempts and usage go on
+        span. Runs on llm_loop: spans are opened by the caller, whose trace
+        context the loop thread does not see.
+        """
+        for attempt in range(self.max_retries + 1):
+            span.incr("attempts")
+            await self.bucket.aacquire()
+            try:
+                async with self._semaphore:
+                    result = await asyncio.wait_for(self.runnable.ainvoke(prompt), self.timeout)
+                return self._unwrap(result, span)
+            except Exception as exc:
+                if attempt == self.max_retries or not is_retryable(exc):
+                    raise
+            await asyncio.sleep(self._backoff(attempt))
+
+    def invoke(self, prompt: Any):
+        with tracer.span(self.name) as span:
+            return llm_loop.run(self._acall(prompt, span))
+
+    async def ainvoke(self, prompt: Any):
+        with tracer.span(self.name) as span:
+            return await llm_loop.arun(self._acall(prompt, span))
+
+    async def _agather(self, prompts: Sequence[Any], span) -> List[Any]:
+        return list(await asyncio.gather(*(self._acall(p, span) for p in prompts)))
+
+    async def abatch(self, prompts: Sequence[Any]) -> List[Any]:
+        """
+        Run prompts concurrently (at most max_concurrency in flight), each
+        with its own timeout and retries, so a slow or failed item never
+        resends the items that already succeeded. Results keep prompt order.
+        """
+        if not prompts:
+            return []
+        with tracer.span(f"{self.name}.batch", batch_size=len(prompts)) as span:
+            return await llm_loop.arun(self._agather(prompts, span))
+
+
+llm_rate_limiter = TokenBucket(LLM_RATE_PER_SEC, LLM_BURST)
+
 # Structured output for CPT
 class CPT_Output(BaseModel):
     CPT: List[Annotated[str, Field(min_length=5, max_length=5, description="CPT code descrbing the chart note")]]
 
-structured_llm = llm.with_structured_output(CPT_Output)
+structured_llm = RateLimitedLLM(
+    bucket=llm_rate_limiter,
+    name="llm.cpt",
+    factory=lambda: get_llm().with_structured_output(CPT_Output, include_raw=True),
+)
 
 # Structured output for ICD
 class ICD_Output(BaseModel):
@@ -23,4 +231,22 @@ class ICD_Output(BaseModel):
         description="Final ICD-10 codes (1–4 most relevant)"
     )
 
-icd_structured_llm = llm.with_structured_output(ICD_Output)
+icd_structured_llm = RateLimitedLLM(
+    bucket=llm_rate_limiter,
+    name="llm.icd",
+    factory=lambda: get_llm().with_structured_output(ICD_Output, include_raw=True),
+)
+
+# Structured output for the combined CPT + ICD call (LLM_COMBINED_CODING)
+class Coding_Output(BaseModel):
+    CPT: List[Annotated[str, Field(min_length=5, max_length=5, description="CPT code descrbing the chart note")]]
+    ICD10: List[str] = Field(
+        default_factory=list,
+        description="Final ICD-10 codes (1–4 most relevant)"
+    )
+
+coding_structured_llm = RateLimitedLLM(
+    bucket=llm_rate_limiter,
+    name="llm.coding",
+    factory=lambda: get_llm().with_structured_output(Coding_Output, include_raw=True),
+)
@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import cli
+from benchmarks.pdf_writer import text_pdf
+from benchmarks.synthetic import soap_note_pages
+from models.embeddings import build_icd_embedding_store, embed_texts
+from models.fake_encoders import install_fake_encoders
+from models.fake_llm import install_fake_llm
+from utils.export_utils import parquet_available
+from utils.result_cache import result_cache
+
+
+@pytest.fixture
+def notes_dir(tmp_path, monkeypatch):
+    install_fake_llm()
+    install_fake_encoders()
+    monkeypatch.setattr(result_cache, "enabled", False)
+    # No persisted ICD store under .cache
+    monkeypatch.setattr(cli, "build_embeddings", lambda df, mapping_file: build_icd_embedding_store(df, embed_texts))
+    source = tmp_path / "notes"
+    for i, folder in enumerate(["a", "b", "b/c"]):
+        os.makedirs(source / folder)
+        (source / folder / "note.pdf").write_bytes(text_pdf(soap_note_pages(i, 1)))
+    return source
+
+
+@pytest.mark.parametrize("extension", [
+    "xlsx",
+    "csv",
+    pytest.param("parquet", marks=pytest.mark.skipif(not parquet_available(), reason="no parquet engine")),
+])
+def test_run_batch_writes_and_resumes(notes_dir, tmp_path, extension):
+    output = str(tmp_path / f"out.{extension}")
+    df = cli.run_batch(str(notes_dir), output, checkpoint_every=2)
+    assert df[cli.FILE_COLUMN].tolist() == ["a/note.pdf", "b/c/note.pdf", "b/note.pdf"]
+    assert not os.path.exists(f"{output}.tmp")
+
+    written = cli.read_results(output)
+    assert written[cli.FILE_COLUMN].tolist() == df[cli.FILE_COLUMN].tolist()
+    assert written["Coding"].tolist() == df["Coding"].tolist()
+
+    resumed = cli.run_batch(str(notes_dir), output, resume=True)
+    assert resumed[cli.FILE_COLUMN].tolist() == df[cli.FILE_COLUMN].tolist()
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from models.fake_llm import FakeRateLimitError, FakeStructuredLLM, fake_cpt_response
+from models.llm import CPT_Output, RateLimitedLLM, TokenBucket, is_retryable
+
+
+def make_llm(runnable, **kwargs):
+    kwargs.setdefault("backoff_base", 0.0)
+    return RateLimitedLLM(runnable, **kwargs)
+
+
+def fake_runnable(**kwargs):
+    return FakeStructuredLLM(CPT_Output, fake_cpt_response, **kwargs)
+
+
+class FailingRunnable:
+    def __init__(self, exc):
+        self.exc = exc
+        self.calls = 0
+
+    def invoke(self, prompt, config=None):
+        self.calls += 1
+        raise self.exc
+
+    async def ainvoke(self, prompt, config=None):
+        self.calls += 1
+        raise self.exc
+
+
+def test_token_bucket_allows_burst_then_waits():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket._reserve() == 0.0
+    assert bucket._reserve() == 0.0
+    assert bucket._reserve() == pytest.approx(0.1, abs=0.02)
+    # Each later caller waits behind the debt of the ones before it
+    assert bucket._reserve() == pytest.approx(0.2, abs=0.02)
+
+
+def test_token_bucket_disabled_never_waits():
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert all(bucket._reserve() == 0.0 for _ in range(100))
+
+
+def test_token_bucket_refills_over_time():
+    bucket = TokenBucket(rate=50, capacity=1)
+    bucket._reserve()
+    time.sleep(0.05)
+    assert bucket._reserve() == 0.0
+
+
+def test_is_retryable():
+    assert is_retryable(FakeRateLimitError("429"))
+    assert is_retryable(asyncio.TimeoutError())
+    assert not is_retryable(ValueError("bad request"))
+
+
+def test_invoke_retries_rate_limit_error():
+    runnable = fake_runnable(fail_every=1)
+    # Every call fails, so the call is attempted 1 + max_retries times
+    with pytest.raises(FakeRateLimitError):
+        make_llm(runnable, max_retries=2).invoke("duration: 30")
+    assert runnable.calls == 3
+
+    runnable = fake_runnable(fail_every=2)
+    llm = make_llm(runnable, max_retries=2)
+    assert llm.invoke("duration: 30").CPT == ["90832"]
+    assert llm.invoke("duration: 60").CPT == ["90837"]
+    assert runnable.calls == 3
+
+
+def test_ainvoke_retries_rate_limit_error():
+    runnable = fake_runnable(fail_every=2)
+    llm = make_llm(runnable, max_retries=2)
+
+    async def run():
+        return [await llm.ainvoke("duration: 30"), await llm.ainvoke("duration: 60")]
+
+    assert [r.CPT for r in asyncio.run(run())] == [["90832"], ["90837"]]
+    assert runnable.calls == 3
+
+
+def test_non_retryable_error_fails_fast():
+    runnable = FailingRunnable(ValueError("400 invalid argument"))
+    llm = make_llm(runnable, max_retries=4)
+    with pytest.raises(ValueError):
+        llm.invoke("note")
+    with pytest.raises(ValueError):
+        asyncio.run(llm.ainvoke("note"))
+    assert runnable.calls == 2
+
+
+def test_abatch_keeps_order_and_retries_failed_items():
+    runnable = fake_runnable(fail_every=3)
+    llm = make_llm(runnable, max_retries=3, max_concurrency=4)
+    prompts = [f"duration: {30 if i % 2 else 60}" for i in range(12)]
+    results = asyncio.run(llm.abatch(prompts))
+    assert [r.CPT for r in results] == [["90832"] if i % 2 else ["90837"] for i in range(12)]
+    assert runnable.calls > len(prompts)
+    assert asyncio.run(llm.abatch([])) == []
+
+
+def test_abatch_timeout_is_per_item():
+    # Each call fits its timeout, the batch as a whole does not
+    runnable = fake_runnable(latency=0.1)
+    llm = make_llm(runnable, max_concurrency=8, timeout=0.25)
+    results = asyncio.run(llm.abatch(["duration: 60"] * 16))
+    assert len(results) == 16
+    assert runnable.calls == 16
+
+
+def test_abatch_times_out_slow_items():
+    runnable = fake_runnable(latency=0.2)
+    llm = make_llm(runnable, max_retries=1, timeout=0.05)
+    start = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(llm.abatch(["duration: 60"] * 2))
+    # Two attempts of 0.05 s each, not the 0.2 s latency
+    assert time.perf_counter() - start < 0.2
+
+
+class InFlightRunnable:
+    """Records the peak number of concurrent calls and the loops they ran on."""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.in_flight = 0
+        self.peak = 0
+        self.loops = set()
+        self._lock = threading.Lock()
+
+    async def ainvoke(self, prompt, config=None):
+        self.loops.add(id(asyncio.get_running_loop()))
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        return prompt
+
+
+def test_concurrency_limit_is_shared_across_threads():
+    runnable = InFlightRunnable()
+    llm = make_llm(runnable, max_concurrency=2)
+
+    def batch(i):
+        # Like the pipeline's coding threads: a fresh event loop per call
+        return asyncio.run(llm.abatch([f"{i}-{j}" for j in range(4)]))
+
+    def single(i):
+        return llm.invoke(f"sync-{i}")
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        batches = list(pool.map(batch, range(4)))
+        singles = list(pool.map(single, range(4)))
+
+    assert batches == [[f"{i}-{j}" for j in range(4)] for i in range(4)]
+    assert singles == [f"sync-{i}" for i in range(4)]
+    assert runnable.peak == 2
+    # The client only ever sees one event loop
+    assert len(runnable.loops) == 1
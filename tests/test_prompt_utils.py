@@ -0,0 +1,29 @@
+from utils.prompt_utils import compact_note
+
+FORM = "Suicidal ideation?\nDenies\nHomicidal ideation?\nDenies\nSelf-harm?\nDenies"
+BOILERPLATE = "Robertson Practice behavioral health progress note, confidential record"
+
+
+def test_note_within_budget_is_unchanged():
+    note = f"{BOILERPLATE}\nDuration: 45 minutes\n{FORM}\n{BOILERPLATE}"
+    text, before, after = compact_note(note, budget=1000, tokenizer_name="")
+    assert text == note
+    assert before == after
+
+
+def test_over_budget_drops_repeated_long_lines_only():
+    note = "\n".join([BOILERPLATE, "Duration: 45 minutes", FORM, BOILERPLATE, FORM])
+    text, before, after = compact_note(note, budget=40, tokenizer_name="")
+    lines = text.splitlines()
+    assert lines.count(BOILERPLATE) == 1
+    assert lines.count("Denies") == 6
+    assert after < before
+
+
+def test_over_budget_keeps_cue_lines_first():
+    narrative = [f"Client discussed coping strategy number {i} at length." for i in range(50)]
+    note = "\n".join(narrative + ["Duration: 45 minutes", "Service Code: 90832"])
+    text, _, after = compact_note(note, budget=60, tokenizer_name="")
+    assert "Duration: 45 minutes" in text
+    assert "Service Code: 90832" in text
+    assert after <= 60
@@ -0,0 +1,42 @@
+import asyncio
+from typing import List, Dict, Any, Tuple
+from models.llm import coding_structured_llm
+from utils.cpt_utils import ALLOWED_CPTS, allowed_cpts_block, cpt_examples
+
+# Every CPT the combined call may return; its ICD candidates are the union of their mapped ICDs
+COMBINED_CPTS = list(ALLOWED_CPTS)
+
+# Plain str.format template; allowed_cpts and examples are filled in by _coding_prompt
+coding_prompt = ("You are a medical coding assistant.\n"
+                 "Assign the correct CPT code(s) from the allowed CPT list and choose ICD-10 codes "
+                 "ONLY from the allowed ICD list, based on the clinical note.\n"
+                 "Do not guess codes that are not in the lists.\n\n"
+                 "Allowed CPTs:\n{allowed_cpts}\n\n{examples}\n\n"
+                 "Clinical note:\n{note}\n\n"
+                 "Allowed ICDs:\n{allowed_icds}\n\n"
+                 "Return JSON: {{\"CPT\": [\"code1\"], \"ICD10\": [\"code1\",\"code2\"]}}")
+
+def _coding_prompt(note_text: str, ranked: List[Dict[str, Any]]) -> str:
+    allowed_icds_block = "\n".join([f"- {r['icd']} — {r['description']} (score {r['score']:.3f})" for r in ranked])
+    return coding_prompt.format(
+        allowed_cpts=allowed_cpts_block, examples=cpt_examples, note=note_text, allowed_icds=allowed_icds_block
+    )
+
+def predict_coding(note_text: str, ranked_icds: List[Dict[str, Any]]) -> Tuple[List[str], Dict[str, Any]]:
+    """
+    CPTs and ICD selection in one LLM call; the note is sent once. Returns
+    (predicted_cpts, {"ranked", "final"}) like predict_cpt_code + select_icds_for_note.
+    """
+    coding = coding_structured_llm.invoke(_coding_prompt(note_text, ranked_icds))
+    return coding.CPT, {"ranked": ranked_icds, "final": coding.ICD10}
+
+async def apredict_codings(note_texts: List[str],
+                           ranked_icds: List[List[Dict[str, Any]]]) -> List[Tuple[List[str], Dict[str, Any]]]:
+    """predict_coding for several notes in one rate-limited abatch round trip."""
+    prompts = [_coding_prompt(n, r) for n, r in zip(note_texts, ranked_icds)]
+    codings = await coding_structured_llm.abatch(prompts)
+    return [(c.CPT, {"ranked": r, "final": c.ICD10}) for r, c in zip(ranked_icds, codings)]
+
+def predict_codings(note_texts: List[str],
+                    ranked_icds: List[List[Dict[str, Any]]]) -> List[Tuple[List[str], Dict[str, Any]]]:
+    return asyncio.run(apredict_codings(note_texts, ranked_icds))
@@ -1,28 +1,39 @@
 import pandas as pd
 import re
 import math
-from langchain_core.prompts import PromptTemplate
+import asyncio
+import threading
+from typing import List, Optional
+from config import CPT_RULES_ENABLED
 from models.llm import structured_llm
 
+# Allowed CPTs shared by the CPT prompt and the combined coding prompt
+ALLOWED_CPTS = {
+    "90791": "Psychiatric diagnostic evaluation",
+    "90832": "Psychotherapy, 30 minutes with patient",
+    "90837": "Psychotherapy, 60 minutes with patient",
+    "H0004": "Behavioral health counseling and therapy, per 15 minutes",
+    "96130": "Psychological testing evaluation services, first hour",
+    "96131": "Psychological testing evaluation services, each additional hour",
+    "90839": "Psychotherapy for crisis; first 60 minutes (Time range: 30–74 minutes)",
+}
+allowed_cpts_block = "\n".join(f"- {code}: {desc}" for code, desc in ALLOWED_CPTS.items())
+
+cpt_examples = """Examples:
+Note: "Patient presented for initial psychiatric diagnostic interview..." → CPT: 90791
+Note: "Session lasted 60 minutes, focused on psychotherapy..." → CPT: 90837
+Note: "Behavioral therapy session lasted 15 minutes..." → CPT: H0004
+Note: "Patient in acute crisis, session lasted 45 minutes addressing suicidal ideation..." → CPT: 90839"""
+
 cpt_prediction_prompt = """You are a medical coding assistant.
 Assign the correct CPT code(s) from the allowed list below, based on the clinical note.
 Do not guess codes that are not in the list.
 
 Allowed CPTs:
-- 90791: Psychiatric diagnostic evaluation
-- 90832: Psychotherapy, 30 minutes with patient
-- 90837: Psychotherapy, 60 minutes with patient
-- H0004: Behavioral health counseling and therapy, per 15 minutes
-- 96130: Psychological testing evaluation services, first hour
-- 96131: Psychological testing evaluation services, each additional hour
-- 90839: Psychotherapy for crisis; first 60 minutes (Time range: 30–74 minutes)
+""" + allowed_cpts_block + """
 
 
-Examples:
-Note: "Patient presented for initial psychiatric diagnostic interview..." → CPT: 90791
-Note: "Session lasted 60 minutes, focused on psychotherapy..." → CPT: 90837
-Note: "Behavioral therapy session lasted 15 minutes..." → CPT: H0004
-Note: "Patient in acute crisis, session lasted 45 minutes addressing suicidal ideation..." → CPT: 90839
+""" + cpt_examples + """
 
 
 Now classify the following clinical note and return the result in the specified JSON format:
@@ -35,14 +46,19 @@ Return the result in this JSON format:
 """
 
 def predict_cpt_code(soap_note: str):
-    prompt = PromptTemplate(
-        input_variables=["soap_note"],
-        template=cpt_prediction_prompt
-    )
-    soap_note_prompt = prompt.format(soap_note=soap_note)
+    soap_note_prompt = cpt_prediction_prompt.format(soap_note=soap_note)
     response = structured_llm.invoke(soap_note_prompt)
     return response.CPT
 
+async def apredict_cpt_codes(soap_notes: List[str]) -> List[List[str]]:
+    """Classify several notes in one rate-limited abatch round trip."""
+    prompts = [cpt_prediction_prompt.format(soap_note=note) for note in soap_notes]
+    responses = await structured_llm.abatch(prompts)
+    return [response.CPT for response in responses]
+
+def predict_cpt_codes(soap_notes: List[str]) -> List[List[str]]:
+    return asyncio.run(apredict_cpt_codes(soap_notes))
+
 def get_cpt_mapping(df: pd.DataFrame):
     cpt_mapping = {}
     for _, row in df.iterrows():
@@ -54,6 +70,15 @@ def get_cpt_mapping(df: pd.DataFrame):
     return cpt_mapping
 
 
+def duration_minutes(duration_str):
+    """First number of the note's Duration field, in minutes (None if absent)."""
+    if duration_str:
+        match = re.search(r"(\d+)", duration_str)
+        if match:
+            return int(match.group(1))
+    return None
+
+
 def calculate_cpt_units(predicted_cpts, duration_str):
     """
     Returns a list of CPTs with units where applicable.
@@ -62,11 +87,7 @@ def calculate_cpt_units(predicted_cpts, duration_str):
     cpt_with_units = []
 
     # Extract numeric duration in minutes if available
-    duration_min = None
-    if duration_str:
-        match = re.search(r"(\d+)", duration_str)
-        if match:
-            duration_min = int(match.group(1))
+    duration_min = duration_minutes(duration_str)
 
     for cpt in predicted_cpts:
         # Default: just add the code
@@ -94,4 +115,68 @@ def calculate_cpt_units(predicted_cpts, duration_str):
                 extra_units = math.ceil(extra_minutes / 30)
                 cpt_with_units.append(f"90840 x{extra_units}")
 
-    return cpt_with_units
\ No newline at end of file
+    return cpt_with_units
+
+
+## Rule-based CPT fast path. Routine psychotherapy CPTs follow from the note's
+## Duration and Service Code fields; notes with crisis or intake cues, times
+## between the 90832 and 90837 ranges, or a service code that disagrees with
+## the time are left to the LLM. Bump CPT_RULES_VERSION when the rules change
+## (it is part of the result cache key).
+
+CPT_RULES_VERSION = "1"
+
+CRISIS_CUE_RE = re.compile(r"\bcrisis\b|safety plan|imminent (?:risk|danger)", re.IGNORECASE)
+INTAKE_CUE_RE = re.compile(
+    r"diagnostic (?:evaluation|interview|assessment)|initial (?:assessment|evaluation)|\bintake\b",
+    re.IGNORECASE,
+)
+
+
+def time_based_psychotherapy_cpt(minutes: int) -> Optional[str]:
+    """90832 for 16-37 minutes, 90837 for 53+; None in between or below."""
+    if 16 <= minutes <= 37:
+        return "90832"
+    if minutes >= 53:
+        return "90837"
+    return None
+
+
+def rule_based_cpt(clean: str, phi: dict) -> Optional[List[str]]:
+    """CPTs decided from structured fields, or None when the note is ambiguous."""
+    minutes = duration_minutes(phi.get("Duration"))
+    if minutes is None or CRISIS_CUE_RE.search(clean) or INTAKE_CUE_RE.search(clean):
+        return None
+    service_code = phi.get("Service Code", "")
+    if service_code == "H0004":
+        # Units are added from the duration by calculate_cpt_units
+        return ["H0004"]
+    cpt = time_based_psychotherapy_cpt(minutes)
+    if cpt is None or (service_code and service_code != cpt):
+        return None
+    return [cpt]
+
+
+class CptRules:
+    """rule_based_cpt with process-wide counts of notes that skipped / needed the LLM."""
+
+    def __init__(self, enabled: bool = CPT_RULES_ENABLED):
+        self.enabled = enabled
+        self.rule_based = 0
+        self.llm = 0
+        self._lock = threading.Lock()
+
+    def predict(self, clean: str, phi: Optional[dict]) -> Optional[List[str]]:
+        cpts = rule_based_cpt(clean, phi) if self.enabled and phi else None
+        with self._lock:
+            if cpts is None:
+                self.llm += 1
+            else:
+                self.rule_based += 1
+        return cpts
+
+    def stats(self) -> dict:
+        return {"rule_based": self.rule_based, "llm": self.llm}
+
+
+cpt_rules = CptRules()
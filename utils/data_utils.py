@@ -1,14 +1,157 @@
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+from functools import lru_cache
 import pandas as pd
-import streamlit as st
+from config import (
+    EMBED_MODEL_NAME,
+    EMBED_BACKEND,
+    ICD_EMBEDDING_CACHE_DIR,
+    ICD10CM_FILE,
+    MAPPING_SNAPSHOT_DIR,
+)
 from utils.cpt_utils import get_cpt_mapping
 from models.embeddings import build_icd_embedding_store, embed_texts
 
-@st.cache_data
-def load_mappings(file_path="data/Expanded_CPT_to_ICD_mapping.xlsx"):
+# No streamlit here: app.py wraps these in st.cache_* and cli.py uses them directly
+MAPPING_FILE = "data/Expanded_CPT_to_ICD_mapping.xlsx"
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def icd_store_cache_dir(file_path=MAPPING_FILE, model_name=f"{EMBED_MODEL_NAME}@{EMBED_BACKEND}",
+                        icd10cm_file=ICD10CM_FILE) -> str:
+    source = file_sha256(file_path)
+    if icd10cm_file:
+        source += f"+{file_sha256(icd10cm_file)}"
+    key = hashlib.sha256(f"{source}:{model_name}".encode()).hexdigest()[:16]
+    return os.path.join(ICD_EMBEDDING_CACHE_DIR, key)
+
+
+# Bump when the snapshot contents change
+SNAPSHOT_VERSION = 2
+
+# abs path -> ((mtime_ns, size), sha256, snapshot) of the last load
+_mapping_snapshots = {}
+_mapping_lock = threading.Lock()
+
+
+def _parse_mapping(file_path: str) -> dict:
     df = pd.read_excel(file_path)
-    mapping = get_cpt_mapping(df)
-    return df, mapping
+    return {"df": df, "cpt_mapping": get_cpt_mapping(df)}
+
+
+def _read_snapshot(snapshot_path: str):
+    """Pickled snapshot, or None when missing or unreadable (e.g. written by another pandas version)."""
+    try:
+        with open(snapshot_path, "rb") as f:
+            snapshot = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception:
+        # The caller re-parses the xlsx and overwrites the bad snapshot
+        return None
+    return snapshot if isinstance(snapshot, dict) and {"df", "cpt_mapping"} <= snapshot.keys() else None
+
+
+def load_mapping_snapshot(file_path=MAPPING_FILE, snapshot_dir=MAPPING_SNAPSHOT_DIR) -> dict:
+    """
+    Parsed mapping sheet: {"sha256", "df", "cpt_mapping"}. The xlsx is
+    parsed once per content hash and pickled under snapshot_dir; later
+    loads, in this or another process, read the snapshot (an unreadable
+    snapshot is replaced by re-parsing the xlsx). Each call re-checks the
+    file's mtime and size, so an edited sheet is picked up without a
+    restart (the same dict is returned while the file is unchanged).
+    """
+    path = os.path.abspath(file_path)
+    stat = os.stat(path)
+    stat_key = (stat.st_mtime_ns, stat.st_size)
+    with _mapping_lock:
+        cached = _mapping_snapshots.get(path)
+        if cached and cached[0] == stat_key:
+            return cached[2]
+        sha256 = file_sha256(path)
+        if cached and cached[1] == sha256:
+            # Touched but not edited
+            _mapping_snapshots[path] = (stat_key, sha256, cached[2])
+            return cached[2]
+
+        snapshot = None
+        snapshot_path = os.path.join(snapshot_dir, f"{sha256}.v{SNAPSHOT_VERSION}.pkl") if snapshot_dir else None
+        if snapshot_path:
+            snapshot = _read_snapshot(snapshot_path)
+        if snapshot is None:
+            snapshot = {"sha256": sha256, **_parse_mapping(path)}
+            if snapshot_path:
+                os.makedirs(snapshot_dir, exist_ok=True)
+                tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, snapshot_path)
+        _mapping_snapshots[path] = (stat_key, sha256, snapshot)
+        return snapshot
+
+
+def load_mappings(file_path=MAPPING_FILE):
+    snapshot = load_mapping_snapshot(file_path)
+    return snapshot["df"], snapshot["cpt_mapping"]
+
+
+def _dotted(code: str) -> str:
+    # CMS files list codes without the dot (F411); the mapping sheet uses F41.1
+    code = code.strip().upper()
+    return code if "." in code or len(code) <= 3 else f"{code[:3]}.{code[3:]}"
+
+
+@lru_cache(maxsize=None)
+def load_icd10cm(file_path=ICD10CM_FILE) -> pd.DataFrame:
+    """
+    Full ICD-10-CM code set as "ICD-10 Code" / "ICD-10 Description" columns.
+    Reads the CMS code file (icd10cm_codes_YYYY.txt: code, whitespace,
+    description per line) or a .csv / .xlsx whose first two columns are code
+    and description.
+    """
+    if file_path.endswith((".csv", ".xlsx", ".xls")):
+        raw = pd.read_csv(file_path, dtype=str) if file_path.endswith(".csv") else pd.read_excel(file_path, dtype=str)
+        pairs = zip(raw.iloc[:, 0].fillna(""), raw.iloc[:, 1].fillna(""))
+    else:
+        with open(file_path, encoding="utf-8") as f:
+            pairs = [line.rstrip("\n").split(None, 1) for line in f if line.strip()]
+        pairs = [(p[0], p[1].strip() if len(p) > 1 else "") for p in pairs]
+    df = pd.DataFrame(
+        [(_dotted(code), desc) for code, desc in pairs if code.strip()],
+        columns=["ICD-10 Code", "ICD-10 Description"],
+    )
+    return df.drop_duplicates("ICD-10 Code").reset_index(drop=True)
+
+
+_embedding_stores = {}
+
+
+def build_embeddings(df, file_path=MAPPING_FILE, icd10cm_file=ICD10CM_FILE):
+    cache_dir = icd_store_cache_dir(file_path, icd10cm_file=icd10cm_file)
+    if cache_dir not in _embedding_stores:
+        icd10cm_df = None
+        if icd10cm_file:
+            # Codes the mapping sheet already lists keep the sheet's description
+            icd10cm_df = load_icd10cm(icd10cm_file)
+            icd10cm_df = icd10cm_df[~icd10cm_df["ICD-10 Code"].isin(df["ICD-10 Code"].astype(str))]
+        _embedding_stores[cache_dir] = build_icd_embedding_store(
+            df, embed_texts, cache_dir=cache_dir, icd10cm_df=icd10cm_df
+        )
+    return _embedding_stores[cache_dir]
+
 
-@st.cache_resource
-def build_embeddings(df):
-    return build_icd_embedding_store(df, embed_texts)
+def invalidate_embeddings(store):
+    """Drop a superseded ICD store from memory and its persisted cache (matrix, ANN index) from disk."""
+    if store.cache_dir:
+        _embedding_stores.pop(store.cache_dir, None)
+        shutil.rmtree(store.cache_dir, ignore_errors=True)
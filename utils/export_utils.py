@@ -0,0 +1,67 @@
+import hashlib
+import io
+import pandas as pd
+from config import EXPORT_STREAMING_ROWS
+
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# label -> (file extension, mime type)
+EXPORT_FORMATS = {
+    "Excel (.xlsx)": ("xlsx", XLSX_MIME),
+    "CSV (.csv)": ("csv", "text/csv"),
+    "Parquet (.parquet)": ("parquet", "application/vnd.apache.parquet"),
+}
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        try:
+            import fastparquet  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+
+def results_digest(df: pd.DataFrame) -> str:
+    """Content hash of a results table, used to cache its serialized exports."""
+    digest = hashlib.sha256("\x1f".join(map(str, df.columns)).encode("utf-8"))
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def write_xlsx(df: pd.DataFrame, target, sheet_name: str = "Results",
+               streaming_rows: int = EXPORT_STREAMING_ROWS):
+    """
+    Write df to an .xlsx path or binary buffer. Tables of streaming_rows rows
+    or more go through a write-only openpyxl workbook, which streams rows to
+    the file instead of building every cell in memory first.
+    """
+    if len(df) < streaming_rows:
+        with pd.ExcelWriter(target, engine="openpyxl") as writer:
+            df.to_excel(writer, index=False, sheet_name=sheet_name)
+        return
+
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name)
+    sheet.append([str(c) for c in df.columns])
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        sheet.append(row)
+    workbook.save(target)
+
+
+def export_bytes(df: pd.DataFrame, extension: str) -> bytes:
+    """Serialize df as xlsx, csv or parquet."""
+    if extension == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    buffer = io.BytesIO()
+    if extension == "parquet":
+        df.to_parquet(buffer, index=False)
+    else:
+        write_xlsx(df, buffer)
+    return buffer.getvalue()
+
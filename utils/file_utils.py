@@ -1,35 +1,305 @@
-from utils.pdf_utils import load_pdf, deidentify_and_strip
-from utils.cpt_utils import predict_cpt_code, calculate_cpt_units
-from utils.icd_utils import get_icd_candidates, select_icds_for_note
-from models.embeddings import rerank_icd_candidates
+import hashlib
+import os
+from config import (
+    LLM_MODEL_NAME,
+    EMBED_MODEL_NAME,
+    EMBED_BACKEND,
+    CROSS_ENCODER_MODEL_NAME,
+    CROSS_ENCODER_BACKEND,
+    NOTE_CHUNKING,
+    NOTE_CHUNK_WORDS,
+    NOTE_CHUNK_OVERLAP_WORDS,
+    NOTE_CHUNK_POOLING,
+    CROSS_ENCODER_WINDOWS,
+    ICD10CM_FILE,
+    ANN_BACKEND,
+    ANN_CANDIDATES,
+    ANN_CPT_FILTER,
+    CPT_RULES_ENABLED,
+    LLM_COMBINED_CODING,
+    COMBINED_ICD_TOP_K,
+    PROMPT_COMPACTION,
+    PROMPT_TOKEN_BUDGET,
+    PROMPT_TOKENIZER,
+)
+from utils.pdf_utils import extract_note
+from utils.cpt_utils import (
+    predict_cpt_code,
+    predict_cpt_codes,
+    calculate_cpt_units,
+    cpt_prediction_prompt,
+    cpt_rules,
+    CPT_RULES_VERSION,
+)
+from utils.icd_utils import (
+    select_icds_for_note,
+    select_icds_for_notes,
+    icd_selection_prompt,
+)
+from utils.prompt_utils import note_compactor, COMPACTION_VERSION
+from utils.coding_utils import COMBINED_CPTS, coding_prompt, predict_coding, predict_codings
+from models.embeddings import rank_icds_batch
 from utils.validation_utils import check_note
-from utils.phi_utils import get_phi
 from utils.psych_eval_utils import extract_psych_eval_data
+from utils.result_cache import ResultCache, result_cache
+from utils.tracing import tracer
+
+# Psych evaluation CPTs
+PSYCH_CPTS = ["96130", "96131", "96138", "96139"]
+
+# Columns of the results table / export
+HEADERS = [
+    "Date",
+    "Appointment Type",
+    "Client Name",
+    "DOB",
+    "Service Code",
+    "Service Description",
+    "Clinician Name",
+    "POS",
+    "Modifier",
+    "Coding",
+    "Note Status",
+    "Status",
+    "Comments",
+]
+
+# Status of the row yielded for a file that could not be processed
+ERROR_STATUS = "Error"
+
+# Cached results are invalidated whenever a prompt or model changes
+PROMPT_VERSION = hashlib.sha256(
+    (
+        cpt_prediction_prompt
+        + icd_selection_prompt
+        + (coding_prompt if LLM_COMBINED_CODING else "")
+    ).encode("utf-8")
+).hexdigest()[:12]
+CACHE_MODEL_NAME = (
+    f"{LLM_MODEL_NAME}|{EMBED_MODEL_NAME}@{EMBED_BACKEND}"
+    f"|{CROSS_ENCODER_MODEL_NAME}@{CROSS_ENCODER_BACKEND}"
+    + (
+        f"|chunks={NOTE_CHUNK_WORDS}/{NOTE_CHUNK_OVERLAP_WORDS}/{NOTE_CHUNK_POOLING}/{CROSS_ENCODER_WINDOWS}"
+        if NOTE_CHUNKING else ""
+    )
+    + (f"|icd10cm={ANN_BACKEND}/{ANN_CANDIDATES}/{ANN_CPT_FILTER}" if ICD10CM_FILE else "")
+    + (f"|cpt_rules={CPT_RULES_VERSION}" if CPT_RULES_ENABLED else "")
+    + (
+        f"|compact={COMPACTION_VERSION}/{PROMPT_TOKEN_BUDGET}/{PROMPT_TOKENIZER}"
+        if PROMPT_COMPACTION else ""
+    )
+)
 
 
 def process_file(uploaded_file, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store):
-    file_path = f"data/{uploaded_file.name}"
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.read())
+    note = extract_note(uploaded_file.name, uploaded_file)
+    return code_note(note, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store)
 
-    text = load_pdf(file_path)
-    clean = deidentify_and_strip(text)
-    phi_data = get_phi(text)
-    service_code = phi_data.get("Service Code", "")
 
-    # Psych evaluation CPTs
-    psych_cpts = ["96130", "96131", "96138", "96139"]
+def error_row(exc: BaseException) -> dict:
+    """Results row standing in for a file that failed to load or code."""
+    row = dict.fromkeys(HEADERS, "")
+    row["Status"] = ERROR_STATUS
+    row["Comments"] = f"Processing failed: {type(exc).__name__}: {exc}"
+    return row
+
+
+def is_error_row(row: dict) -> bool:
+    return row.get("Status") == ERROR_STATUS
+
+
+def is_psych_eval(note: dict) -> bool:
+    return note["phi"].get("Service Code", "") in PSYCH_CPTS
+
+
+def _cache_model_name(icd_embedding_store):
+    # The ICD store's cache directory is keyed by the mapping file hash, so
+    # editing the mapping sheet also invalidates cached coding results
+    if icd_embedding_store.cache_dir:
+        return f"{CACHE_MODEL_NAME}|icd_store={os.path.basename(icd_embedding_store.cache_dir)}"
+    return CACHE_MODEL_NAME
+
+
+def _cached_codes(cache_key):
+    with tracer.span("result_cache") as span:
+        cached = result_cache.get(cache_key)
+        span.set("hit", cached is not None)
+    if cached is None:
+        return None
+    return cached["cpts"], {"ranked": cached["ranked"], "final": cached["final"]}
+
+
+def _drop_unpaired_90840(predicted_cpts):
+    if "90840" in predicted_cpts and "90839" not in predicted_cpts:
+        predicted_cpts.remove("90840")
+    return predicted_cpts
+
+
+def _cache_codes(cache_key, predicted_cpts, final_selection):
+    result_cache.put(
+        cache_key,
+        {
+            "cpts": predicted_cpts,
+            "ranked": final_selection["ranked"],
+            "final": final_selection["final"],
+        },
+    )
+
+
+def _compact_notes(cleans):
+    """Prompt text per note (see utils.prompt_utils); the span records tokens saved."""
+    with tracer.span("compact_note", batch_size=len(cleans)) as span:
+        compacted = [note_compactor.compact(c) for c in cleans]
+        span.set("tokens_before", sum(before for _, before, _ in compacted))
+        span.set("tokens_after", sum(after for _, _, after in compacted))
+    return [text for text, _, _ in compacted]
+
+
+def _rank_icds(clean, cpts, icd_embedding_store, top_k, note_emb=None):
+    """ICD candidates of cpts ranked against the note (embeddings + cross-encoder)."""
+    with tracer.span("rerank_icd_candidates"):
+        return rank_icds_batch(
+            [clean], [cpts], icd_embedding_store, top_k=top_k,
+            note_embs=None if note_emb is None else [note_emb],
+        )[0]
+
 
-    if service_code in psych_cpts:
+def predict_codes(clean, cpt_mapping, icd_embedding_store, note_emb=None, phi=None):
+    """
+    CPT prediction (rules from phi when unambiguous, else LLM), ICD ranking and
+    LLM ICD selection for a de-identified note, served from the result cache
+    when the same note was coded before. With LLM_COMBINED_CODING, notes the
+    rules leave ambiguous get their CPTs and ICDs from one predict_coding call.
+    """
+    cache_key = ResultCache.make_key(clean, PROMPT_VERSION, _cache_model_name(icd_embedding_store))
+    cached = _cached_codes(cache_key)
+    if cached is not None:
+        return cached
+
+    # The LLM prompts get the compacted note; ranking and rules use the full text
+    prompt_note = _compact_notes([clean])[0]
+    with tracer.span("predict_cpt_code") as span:
+        predicted_cpts = cpt_rules.predict(clean, phi)
+        span.set("rule_based", predicted_cpts is not None)
+        if predicted_cpts is None and not LLM_COMBINED_CODING:
+            predicted_cpts = _drop_unpaired_90840(predict_cpt_code(prompt_note))
+
+    if predicted_cpts is None:
+        ranked_icds = _rank_icds(clean, COMBINED_CPTS, icd_embedding_store, COMBINED_ICD_TOP_K, note_emb)
+        with tracer.span("predict_coding"):
+            predicted_cpts, final_selection = predict_coding(prompt_note, ranked_icds)
+        predicted_cpts = _drop_unpaired_90840(predicted_cpts)
+    else:
+        # ICD selection
+        ranked_icds = _rank_icds(clean, predicted_cpts, icd_embedding_store, 5, note_emb)
+        with tracer.span("select_icds_for_note"):
+            final_selection = select_icds_for_note(prompt_note, predicted_cpts, ranked_icds)
+
+    _cache_codes(cache_key, predicted_cpts, final_selection)
+    return predicted_cpts, final_selection
+
+
+def predict_codes_batch(cleans, cpt_mapping, icd_embedding_store, note_embs=None, phis=None):
+    """
+    predict_codes for several notes: one CPT abatch (for notes the rules
+    leave ambiguous), one ICD scoring pass (rank_icds_batch) and one
+    ICD-selection abatch for all cache misses. With LLM_COMBINED_CODING the
+    ambiguous notes are ranked against every allowed CPT's ICDs and coded
+    by one predict_codings abatch instead of the CPT and ICD calls.
+    Returns (predicted_cpts, final_selection) per note.
+    """
+    phis = phis or [None] * len(cleans)
+    model_name = _cache_model_name(icd_embedding_store)
+    keys = [ResultCache.make_key(c, PROMPT_VERSION, model_name) for c in cleans]
+    results = [_cached_codes(k) for k in keys]
+    misses = [i for i, r in enumerate(results) if r is None]
+    if not misses:
+        return results
+
+    def miss_embs(idx):
+        return None if note_embs is None else [note_embs[misses[j]] for j in idx]
+
+    miss_cleans = [cleans[i] for i in misses]
+    prompt_notes = _compact_notes(miss_cleans)
+    selections = [None] * len(misses)
+    with tracer.span("predict_cpt_code", batch_size=len(misses)) as span:
+        predicted = [cpt_rules.predict(cleans[i], phis[i]) for i in misses]
+        llm_idx = [j for j, cpts in enumerate(predicted) if cpts is None]
+        span.set("rule_based", len(misses) - len(llm_idx))
+        if llm_idx and not LLM_COMBINED_CODING:
+            llm_cpts = predict_cpt_codes([prompt_notes[j] for j in llm_idx])
+            for j, cpts in zip(llm_idx, llm_cpts):
+                predicted[j] = _drop_unpaired_90840(cpts)
+
+    if llm_idx and LLM_COMBINED_CODING:
+        texts = [miss_cleans[j] for j in llm_idx]
+        with tracer.span("rerank_icd_candidates", batch_size=len(llm_idx)):
+            ranked = rank_icds_batch(
+                texts, [COMBINED_CPTS] * len(llm_idx), icd_embedding_store,
+                top_k=COMBINED_ICD_TOP_K, note_embs=miss_embs(llm_idx),
+            )
+        with tracer.span("predict_coding", batch_size=len(llm_idx)):
+            codings = predict_codings([prompt_notes[j] for j in llm_idx], ranked)
+        for j, (cpts, final_selection) in zip(llm_idx, codings):
+            predicted[j] = _drop_unpaired_90840(cpts)
+            selections[j] = final_selection
+
+    todo = [j for j, s in enumerate(selections) if s is None]
+    if todo:
+        texts = [miss_cleans[j] for j in todo]
+        with tracer.span("rerank_icd_candidates", batch_size=len(todo)):
+            ranked = rank_icds_batch(
+                texts, [predicted[j] for j in todo], icd_embedding_store, top_k=5,
+                note_embs=miss_embs(todo),
+            )
+        with tracer.span("select_icds_for_note", batch_size=len(todo)):
+            for j, final_selection in zip(
+                todo,
+                select_icds_for_notes([prompt_notes[j] for j in todo], [predicted[j] for j in todo], ranked),
+            ):
+                selections[j] = final_selection
+
+    for i, predicted_cpts, final_selection in zip(misses, predicted, selections):
+        _cache_codes(keys[i], predicted_cpts, final_selection)
+        results[i] = (predicted_cpts, final_selection)
+    return results
+
+
+def _service_descriptions(service_code, cpt_mapping):
+    # cpt_mapping holds the sheet's first description per CPT: a dict lookup
+    # instead of scanning the mapping DataFrame for every note
+    entry = cpt_mapping.get(service_code) if service_code else None
+    return [entry["description"]] if entry else []
+
+
+def code_note(note, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store, note_emb=None, codes=None):
+    """
+    Second stage of processing a note (output of extract_note): LLM coding,
+    ICD ranking and validation. Returns the results row and emits one trace.
+    Pass codes (from predict_codes_batch) to skip the per-note prediction.
+    """
+    with tracer.trace(note["name"]) as trace:
+        if trace is not None:
+            for span in note.get("spans", []):
+                trace.add_span(**span)
+        return _code_note(note, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store, note_emb, codes)
+
+
+def _code_note(note, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store, note_emb=None, codes=None):
+    text = note["text"]
+    clean = note["clean"]
+    phi_data = note["phi"]
+    service_code = phi_data.get("Service Code", "")
+
+    if is_psych_eval(note):
         # Run psych evaluation logic
-        psych_data = extract_psych_eval_data(text)
+        psych_data = extract_psych_eval_data(
+            text, {"phi": phi_data, "procedures": note.get("procedures")}
+        )
         units = psych_data["Follow up code Units"]
 
         # CPT description safely
-        service_descriptions = []
-        service_desc_df = cpt_icd_mapping_df[cpt_icd_mapping_df["CPT"] == service_code]
-        if not service_desc_df.empty:
-            service_descriptions.append(service_desc_df["CPT Description"].iloc[0])
+        service_descriptions = _service_descriptions(service_code, cpt_mapping)
 
         # Build coding string using phi diagnosis codes
         unit_str = f"{units}X" if units > 0 else ""
@@ -41,19 +311,13 @@ def process_file(uploaded_file, cpt_mapping, cpt_icd_mapping_df, icd_embedding_s
 
     else:
         # Normal flow for other CPTs (908x etc.)
-        predicted_cpts = predict_cpt_code(clean)
-        if "90840" in predicted_cpts and "90839" not in predicted_cpts:
-            predicted_cpts.remove("90840")
-
-        # ICD selection
-        icd_candidates = get_icd_candidates(predicted_cpts, cpt_mapping)
-        ranked_icds = rerank_icd_candidates(
-            clean, icd_candidates, icd_embedding_store, top_k=5
+        predicted_cpts, final_selection = codes or predict_codes(
+            clean, cpt_mapping, icd_embedding_store, note_emb, phi_data
         )
-        final_selection = select_icds_for_note(clean, predicted_cpts, ranked_icds)
 
         # Note validation
-        validation_result = check_note(clean, uploaded_file.name)
+        with tracer.span("check_note"):
+            validation_result = check_note(clean, note["name"])
         comments_str = (
             f"Missing: {', '.join(validation_result['missing_sections'])}"
             if validation_result["missing_sections"]
@@ -65,13 +329,7 @@ def process_file(uploaded_file, cpt_mapping, cpt_icd_mapping_df, icd_embedding_s
         cpt_with_units = calculate_cpt_units(predicted_cpts, duration_str)
 
         # CPT descriptions safely
-        service_descriptions = []
-        if service_code:
-            service_desc_df = cpt_icd_mapping_df[
-                cpt_icd_mapping_df["CPT"] == service_code
-            ]
-            if not service_desc_df.empty:
-                service_descriptions.append(service_desc_df["CPT Description"].iloc[0])
+        service_descriptions = _service_descriptions(service_code, cpt_mapping)
 
         # Build coding string using predicted CPT units and ICDs
         row_coding = (
@@ -0,0 +1,249 @@
+import hashlib
+import json
+import os
+import queue
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional, Tuple
+from config import JOB_DB_PATH, JOB_SPOOL_DIR, JOB_WORKERS, JOB_TTL_S
+from utils.file_utils import is_error_row
+from utils.pipeline import process_files
+
+# Job / file states
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class SpooledFile:
+    """A submitted PDF on disk; process_files hands it to workers by path."""
+
+    def __init__(self, path: str, name: str):
+        self.path = path
+        self.name = name
+
+    def read(self) -> bytes:
+        with open(self.path, "rb") as f:
+            return f.read()
+
+
+class JobStore:
+    """
+    SQLite record of submitted jobs and their files: status, result rows and
+    errors. Shared by every Streamlit session (and restarts) of a deployment.
+    """
+
+    def __init__(self, path: str = JOB_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, label TEXT NOT NULL, status TEXT NOT NULL, "
+                "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS job_files ("
+                "job_id TEXT NOT NULL, idx INTEGER NOT NULL, name TEXT NOT NULL, "
+                "sha256 TEXT NOT NULL, path TEXT NOT NULL, status TEXT NOT NULL, "
+                "row TEXT, error TEXT, PRIMARY KEY (job_id, idx))"
+            )
+            self._conn.commit()
+        return self._conn
+
+    def _execute(self, sql: str, params=()):
+        with self._lock:
+            conn = self._connection()
+            rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+        return rows
+
+    def create_job(self, job_id: str, label: str, files: List[Tuple[str, str, str]]):
+        """files: (name, sha256, spool path) in submission order."""
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT INTO jobs (id, label, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, label, QUEUED, now, now),
+            )
+            conn.executemany(
+                "INSERT INTO job_files (job_id, idx, name, sha256, path, status) VALUES (?, ?, ?, ?, ?, ?)",
+                [(job_id, i, name, sha, path, QUEUED) for i, (name, sha, path) in enumerate(files)],
+            )
+            conn.commit()
+
+    def set_status(self, job_id: str, status: str, error: Optional[str] = None):
+        self._execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, time.time(), job_id),
+        )
+
+    def file_done(self, job_id: str, idx: int, row: dict):
+        self._execute(
+            "UPDATE job_files SET status = ?, row = ? WHERE job_id = ? AND idx = ?",
+            (DONE, json.dumps(row), job_id, idx),
+        )
+
+    def file_failed(self, job_id: str, idx: int, error: str):
+        self._execute(
+            "UPDATE job_files SET status = ?, error = ? WHERE job_id = ? AND idx = ?",
+            (FAILED, error, job_id, idx),
+        )
+
+    def pending_files(self, job_id: str) -> List[Tuple[int, str, str]]:
+        """(idx, name, path) of files without a result yet."""
+        return self._execute(
+            "SELECT idx, name, path FROM job_files WHERE job_id = ? AND status != ? ORDER BY idx",
+            (job_id, DONE),
+        )
+
+    def job(self, job_id: str) -> Optional[dict]:
+        rows = self._execute(
+            "SELECT j.id, j.label, j.status, j.error, j.created_at, j.updated_at, "
+            "COUNT(f.idx), SUM(f.status = ?) "
+            "FROM jobs j LEFT JOIN job_files f ON f.job_id = j.id WHERE j.id = ? GROUP BY j.id",
+            (DONE, job_id),
+        )
+        if not rows:
+            return None
+        keys = ("id", "label", "status", "error", "created_at", "updated_at", "total", "done")
+        job = dict(zip(keys, rows[0]))
+        job["done"] = job["done"] or 0
+        return job
+
+    def files(self, job_id: str) -> List[dict]:
+        """Files of a job in submission order, with their result row (None until done)."""
+        rows = self._execute(
+            "SELECT idx, name, sha256, status, row, error FROM job_files WHERE job_id = ? ORDER BY idx",
+            (job_id,),
+        )
+        return [
+            {"idx": idx, "name": name, "sha256": sha, "status": status,
+             "row": json.loads(row) if row else None, "error": error}
+            for idx, name, sha, status, row, error in rows
+        ]
+
+    def jobs(self, statuses=None, limit: int = 50) -> List[str]:
+        """Most recent job ids first, optionally only those in statuses."""
+        if statuses:
+            marks = ", ".join("?" * len(statuses))
+            rows = self._execute(
+                f"SELECT id FROM jobs WHERE status IN ({marks}) ORDER BY created_at DESC LIMIT ?",
+                (*statuses, limit),
+            )
+        else:
+            rows = self._execute("SELECT id FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        return [r[0] for r in rows]
+
+    def purge(self, older_than: float) -> List[str]:
+        """Delete finished jobs last updated before older_than; returns their ids."""
+        ids = [r[0] for r in self._execute(
+            "SELECT id FROM jobs WHERE updated_at < ? AND status IN (?, ?)", (older_than, DONE, FAILED)
+        )]
+        for job_id in ids:
+            self._execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+            self._execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+        return ids
+
+
+class JobQueue:
+    """
+    Background processing of submitted batches. submit() spools the PDFs to
+    disk, records the job in the JobStore and returns a job id at once; a
+    pool of worker threads runs each job through process_files and stores
+    rows as files finish. A job's spooled PDFs are deleted as soon as it
+    ends, and jobs older than ttl are purged on start() and every submit().
+    Unfinished jobs are resumed on start().
+
+    resources is called by workers to get (cpt_icd_mapping_df, cpt_mapping,
+    icd_embedding_store), e.g. Warmup.result.
+    """
+
+    def __init__(self, resources: Callable[[], Tuple], store: Optional[JobStore] = None,
+                 workers: int = JOB_WORKERS, spool_dir: str = JOB_SPOOL_DIR, ttl: float = JOB_TTL_S):
+        self.resources = resources
+        self.store = store or JobStore()
+        self.workers = max(1, workers)
+        self.spool_dir = spool_dir
+        self.ttl = ttl
+        self._queue = queue.Queue()
+        self._threads = []
+
+    def purge(self) -> List[str]:
+        """Drop jobs (rows and any leftover spool files) finished more than ttl ago."""
+        ids = self.store.purge(time.time() - self.ttl)
+        for job_id in ids:
+            self._remove_spool(job_id)
+        return ids
+
+    def _remove_spool(self, job_id: str):
+        shutil.rmtree(os.path.join(self.spool_dir, job_id), ignore_errors=True)
+
+    def start(self) -> "JobQueue":
+        self.purge()
+        for job_id in reversed(self.store.jobs((QUEUED, RUNNING), limit=-1)):
+            self._queue.put(job_id)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, files: List[Tuple[str, bytes]], label: str = "") -> str:
+        """Queue (file name, PDF bytes) pairs for coding; returns the job id."""
+        # A long-running server only starts once, so expired jobs are purged here too
+        self.purge()
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.spool_dir, job_id)
+        os.makedirs(job_dir, exist_ok=True)
+        spooled = []
+        for i, (name, data) in enumerate(files):
+            path = os.path.join(job_dir, f"{i:05d}.pdf")
+            with open(path, "wb") as f:
+                f.write(data)
+            spooled.append((name, hashlib.sha256(data).hexdigest(), path))
+        self.store.create_job(job_id, label, spooled)
+        self._queue.put(job_id)
+        return job_id
+
+    def status(self, job_id: str) -> Optional[dict]:
+        return self.store.job(job_id)
+
+    def results(self, job_id: str) -> List[dict]:
+        return self.store.files(job_id)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: str):
+        self.store.set_status(job_id, RUNNING)
+        try:
+            cpt_icd_mapping_df, cpt_mapping, icd_embedding_store = self.resources()
+            pending = self.store.pending_files(job_id)
+            files = [SpooledFile(path, name) for _, name, path in pending]
+            for idx, row in process_files(files, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store):
+                if is_error_row(row):
+                    # Only this file failed; the job still finishes as done
+                    self.store.file_failed(job_id, pending[idx][0], row["Comments"])
+                else:
+                    self.store.file_done(job_id, pending[idx][0], row)
+        except Exception as exc:
+            self.store.set_status(job_id, FAILED, f"{type(exc).__name__}: {exc}")
+            return
+        finally:
+            # The spooled PDFs hold PHI; rows are all that is kept once the job ends
+            self._remove_spool(job_id)
+        self.store.set_status(job_id, DONE)
@@ -0,0 +1,145 @@
+"""
+Single-pass note scanner: one call per note returns the de-identified text,
+the PHI dict, the diagnosis codes and the psych-eval "Procedures" block.
+
+Outputs match deidentify_and_strip / get_phi / count_procedures /
+contains_psychometrist (except that get_phi raises on notes without a
+diagnosis header, where the scanner just omits "Diagnosis Codes").
+PHI patterns still run over the full text because several of them
+(`\\s*`, `[^,]+`) span line breaks. The gain is that every pattern is
+compiled once, the seven per-line de-identification checks collapse into
+one alternation, and each field is computed once per note rather than
+once per caller.
+"""
+import re
+from typing import Optional
+from utils.phi_utils import format_date, split_date_time
+
+# deidentify_and_strip: a line is dropped if any of these match
+DEID_LINE_RE = re.compile(
+    r"(?i:(?:Patient|Clinician|Participants|Supervisor?):)"
+    r"|(?i:DOB|Date and Time:)"
+    r"|\d{1,2}[/-]\d{1,2}[/-]\d{2,4}"
+    r"|\d{1,2}:\d{2}\s?(?:AM|PM|am|pm)"
+    r"|(?:Location|Clinic|Hospital|Center|LLC|LLP|PC)"
+    r"|License|http|www|Page \d+ of \d+"
+)
+
+CLINICIAN_RE = re.compile(r"Clinician:\s*(.+)")
+SUPERVISOR_RE = re.compile(r"Supervisor:\s*(.+)")
+PATIENT_RE = re.compile(r"Patient:\s*([^,]+),\s*DOB\s*([^\n]+)")
+DATETIME_RE = re.compile(r"Date and Time:\s*([^\n]+)")
+DURATION_RE = re.compile(r"Duration:\s*([^\n]+)")
+SERVICE_CODE_RE = re.compile(r"Service Code:\s*([A-Z0-9]+)")
+DIAGNOSIS_START_RE = re.compile(r"(Diagnosis|Diagnoses|Dx)[:\-]?", re.IGNORECASE)
+DIAGNOSIS_STOP_RE = re.compile(
+    r"(Plan|Treatment|Intervention|Procedure|Assessment)[:\-]?", re.IGNORECASE
+)
+CODE_SPLIT_RE = re.compile(r"([0-9])([A-Z])")
+ICD_RE = re.compile(r"([A-TV-Z][0-9]{2}(?:\.[0-9A-Z]{1,4})?)")
+TRAILING_LETTER_RE = re.compile(r".*[A-Z]$")
+LOCATION_RE = re.compile(
+    r"(Location|Clinic|Hospital|Center|LLC|LLP|PC)[:\-]?\s*(.+)", re.IGNORECASE
+)
+TELEHEALTH_RE = re.compile(r"telehealth|virtual|video", re.IGNORECASE)
+PROCEDURES_RE = re.compile(
+    r"Procedures\s*(.*?)(?:Total Time Spent|Diagnosis|$)", re.DOTALL | re.IGNORECASE
+)
+
+
+def strip_lines(text: str) -> str:
+    cleaned_lines = []
+    for line in text.splitlines():
+        line_stripped = line.strip()
+        if line_stripped and not DEID_LINE_RE.search(line_stripped):
+            cleaned_lines.append(line_stripped)
+    return "\n".join(cleaned_lines)
+
+
+def diagnosis_codes(text: str) -> Optional[list]:
+    section_start = DIAGNOSIS_START_RE.search(text)
+    if not section_start:
+        return None
+    diagnosis_section = text[section_start.start():]
+    stop_match = DIAGNOSIS_STOP_RE.search(diagnosis_section)
+    if stop_match:
+        diagnosis_section = diagnosis_section[:stop_match.start()]
+    if not diagnosis_section:
+        return None
+
+    diagnosis_section = CODE_SPLIT_RE.sub(r"\1 \2", diagnosis_section)
+    # Same set round-trips as get_phi so the resulting order matches it
+    codes = list(set(ICD_RE.findall(diagnosis_section)))
+    cleaned_codes = []
+    for code in codes:
+        if TRAILING_LETTER_RE.match(code):
+            code = code[:-1]
+        cleaned_codes.append(code)
+    return list(set(cleaned_codes))[::-1]
+
+
+def extract_phi(text: str) -> dict:
+    details = {}
+
+    clinician_match = CLINICIAN_RE.search(text)
+    if clinician_match:
+        details["Clinician"] = clinician_match.group(1).strip()
+
+    supervisor_match = SUPERVISOR_RE.search(text)
+    if supervisor_match:
+        details["Supervisor"] = supervisor_match.group(1).strip()
+
+    patient_match = PATIENT_RE.search(text)
+    if patient_match:
+        details["Patient"] = patient_match.group(1).strip()
+        details["DOB"] = format_date(patient_match.group(2).strip())
+
+    datetime_match = DATETIME_RE.search(text)
+    if datetime_match:
+        date_str, time_str = split_date_time(datetime_match.group(1))
+        details["Date"] = date_str
+        if time_str:
+            details["Time"] = time_str
+
+    duration_match = DURATION_RE.search(text)
+    if duration_match:
+        details["Duration"] = duration_match.group(1).strip()
+
+    service_code_match = SERVICE_CODE_RE.search(text)
+    if service_code_match:
+        details["Service Code"] = service_code_match.group(1).strip()
+
+    codes = diagnosis_codes(text)
+    if codes is not None:
+        details["Diagnosis Codes"] = codes
+
+    location_match = LOCATION_RE.search(text)
+    details["Location"] = location_match.group(2).strip() if location_match else ""
+
+    if TELEHEALTH_RE.search(details["Location"]):
+        details["POS"] = "10"
+        details["Modifier"] = "95"
+    else:
+        details["POS"] = "11"
+        details["Modifier"] = ""
+
+    return details
+
+
+def procedures_block(text: str) -> Optional[str]:
+    match = PROCEDURES_RE.search(text)
+    return match.group(1) if match else None
+
+
+def scan_note(text: str) -> dict:
+    """
+    Returns {"clean", "phi", "diagnosis_codes", "procedures"}; "procedures" is
+    the raw "Procedures" section used by the psych-eval unit logic (None if absent).
+    """
+    phi = extract_phi(text)
+    return {
+        "clean": strip_lines(text),
+        "phi": phi,
+        "diagnosis_codes": phi.get("Diagnosis Codes"),
+        "procedures": procedures_block(text),
+    }
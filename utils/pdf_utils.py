@@ -1,10 +1,159 @@
+import hashlib
+import io
+import os
 import re
-from langchain_community.document_loaders import PyPDFLoader
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator, List, Optional, Union
+from pypdf import PdfReader
+from config import (
+    PDF_SPILL_THRESHOLD_BYTES,
+    PDF_BACKEND,
+    PDF_TEXT_CACHE_DIR,
+    PDF_TEXT_CACHE_TTL_S,
+)
+from utils.note_scanner import scan_note
 
-def load_pdf(file_path: str) -> str:
-    loader = PyPDFLoader(file_path)
-    documents = loader.load()
-    return "\n".join([doc.page_content for doc in documents])
+PdfSource = Union[str, os.PathLike, bytes, bytearray, memoryview, BinaryIO]
+
+PDF_BACKENDS = ("pypdf", "pymupdf")
+
+
+@contextmanager
+def open_pdf_stream(source: PdfSource, spill_threshold: int = PDF_SPILL_THRESHOLD_BYTES):
+    """
+    Yield a seekable binary stream for a path, an in-memory buffer or a file-like
+    object. Nothing is written to disk except when a non-seekable stream is larger
+    than spill_threshold, in which case it goes to an anonymous temp file.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            yield f
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        yield io.BytesIO(source)
+    elif source.seekable():
+        source.seek(0)
+        yield source
+    else:
+        with tempfile.SpooledTemporaryFile(max_size=spill_threshold) as buffer:
+            shutil.copyfileobj(source, buffer)
+            buffer.seek(0)
+            yield buffer
+
+
+def resolve_backend(backend: str = PDF_BACKEND) -> str:
+    """backend, or pypdf when the optional pymupdf package is not installed."""
+    if backend not in PDF_BACKENDS:
+        raise ValueError(f"Unknown PDF backend {backend!r}; expected one of {PDF_BACKENDS}")
+    if backend == "pymupdf":
+        try:
+            import pymupdf  # noqa: F401
+        except ImportError:
+            return "pypdf"
+    return backend
+
+
+@contextmanager
+def open_pdf_document(source: PdfSource, backend: str = PDF_BACKEND):
+    """Yield (page count, page index -> text) for the resolved backend."""
+    backend = resolve_backend(backend)
+    with open_pdf_stream(source) as stream:
+        if backend == "pymupdf":
+            import pymupdf
+            with pymupdf.open(stream=stream.read(), filetype="pdf") as doc:
+                yield doc.page_count, lambda i: doc[i].get_text()
+        else:
+            reader = PdfReader(stream)
+            yield len(reader.pages), lambda i: reader.pages[i].extract_text()
+
+
+def iter_pdf_pages(source: PdfSource, start: int = 0, stop: Optional[int] = None,
+                   backend: str = PDF_BACKEND) -> Iterator[str]:
+    """Extract text page by page without materialising the whole document."""
+    with open_pdf_document(source, backend) as (count, page_text):
+        for i in range(start, count if stop is None else min(stop, count)):
+            yield page_text(i)
+
+
+def pdf_page_count(source: PdfSource, backend: str = PDF_BACKEND) -> int:
+    with open_pdf_document(source, backend) as (count, _):
+        return count
+
+
+def extract_pages(source: PdfSource, start: int, stop: int, backend: str = PDF_BACKEND) -> List[str]:
+    """Text of pages [start, stop); one task of a page-parallel extraction."""
+    return list(iter_pdf_pages(source, start, stop, backend))
+
+
+def load_pdf(source: PdfSource, backend: str = PDF_BACKEND) -> str:
+    return "\n".join(iter_pdf_pages(source, backend=backend))
+
+
+def source_sha256(source: PdfSource) -> Optional[str]:
+    """Content hash of a PDF; None for non-seekable streams, which can only be read once."""
+    if not isinstance(source, (str, os.PathLike, bytes, bytearray, memoryview)) and not source.seekable():
+        return None
+    digest = hashlib.sha256()
+    with open_pdf_stream(source) as stream:
+        for chunk in iter(lambda: stream.read(1 << 20), b""):
+            digest.update(chunk)
+        stream.seek(0)
+    return digest.hexdigest()
+
+
+class PdfTextCache:
+    """
+    Extracted text per (PDF content hash, backend), one file each, so a
+    re-run of the same upload skips parsing. Safe to share between worker
+    processes: entries are written to a temp file and renamed into place.
+    Entries hold raw note text, so the cache is off unless PDF_TEXT_CACHE_DIR
+    is set; the caller (process_files, in the parent process) runs prune().
+    """
+
+    def __init__(self, directory: str = PDF_TEXT_CACHE_DIR, ttl: float = PDF_TEXT_CACHE_TTL_S):
+        self.directory = directory
+        self.ttl = ttl
+
+    def _path(self, sha256: str, backend: str) -> str:
+        return os.path.join(self.directory, sha256[:2], f"{sha256}.{backend}.txt")
+
+    def get(self, sha256: Optional[str], backend: str) -> Optional[str]:
+        if not self.directory or sha256 is None:
+            return None
+        try:
+            with open(self._path(sha256, backend), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, sha256: Optional[str], backend: str, text: str):
+        if not self.directory or sha256 is None:
+            return
+        path = self._path(sha256, backend)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def prune(self):
+        """Delete entries written more than ttl ago."""
+        if not self.directory:
+            return
+        cutoff = time.time() - self.ttl
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+pdf_text_cache = PdfTextCache()
 
 def deidentify_and_strip(text: str) -> str:
     cleaned_lines = []
@@ -26,3 +175,65 @@ def deidentify_and_strip(text: str) -> str:
             continue
         cleaned_lines.append(line_stripped)
     return "\n".join(cleaned_lines)
+
+
+def _scanned_note(name: str, text: str, load_span: dict) -> dict:
+    start = time.perf_counter()
+    scan = scan_note(text)
+    return {
+        "name": name,
+        "text": text,
+        "clean": scan["clean"],
+        "phi": scan["phi"],
+        "procedures": scan["procedures"],
+        "spans": [
+            load_span,
+            {"name": "scan_note", "ms": round((time.perf_counter() - start) * 1000, 3)},
+        ],
+    }
+
+
+def extract_note(name: str, data: PdfSource, backend: str = PDF_BACKEND, split_min_pages: int = 0) -> dict:
+    """
+    CPU-bound first stage of processing a note: parse the PDF, de-identify it
+    and pull PHI fields. Kept free of model imports so it can run in a process pool.
+    Timings are returned as plain span dicts because a worker process has no
+    access to the parent's tracer.
+
+    Text is served from pdf_text_cache when the same file was parsed before.
+    With split_min_pages, files of at least that many pages are not parsed
+    here; {"name", "sha256", "backend", "pages"} is returned instead so the
+    caller can fan extract_pages out over page ranges and finish with
+    join_pages_note.
+    """
+    start = time.perf_counter()
+    backend = resolve_backend(backend)
+    sha256 = source_sha256(data)
+    text = pdf_text_cache.get(sha256, backend)
+    if text is not None:
+        ms = round((time.perf_counter() - start) * 1000, 3)
+        span = {"name": "load_pdf", "ms": ms, "chars": len(text), "backend": backend, "cached": True}
+        return _scanned_note(name, text, span)
+
+    if split_min_pages:
+        pages = pdf_page_count(data, backend)
+        if pages >= split_min_pages:
+            return {"name": name, "sha256": sha256, "backend": backend, "pages": pages}
+
+    page_texts = list(iter_pdf_pages(data, backend=backend))
+    text = "\n".join(page_texts)
+    pdf_text_cache.put(sha256, backend, text)
+    ms = round((time.perf_counter() - start) * 1000, 3)
+    span = {"name": "load_pdf", "ms": ms, "chars": len(text), "pages": len(page_texts), "backend": backend}
+    return _scanned_note(name, text, span)
+
+
+def join_pages_note(split: dict, page_texts: List[str], ms: float) -> dict:
+    """Finish a split extraction (see extract_note): join, cache and scan the pages."""
+    text = "\n".join(page_texts)
+    pdf_text_cache.put(split["sha256"], split["backend"], text)
+    span = {
+        "name": "load_pdf", "ms": round(ms, 3), "chars": len(text), "pages": len(page_texts),
+        "backend": split["backend"], "page_parallel": True,
+    }
+    return _scanned_note(split["name"], text, span)
@@ -0,0 +1,165 @@
+import multiprocessing
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from typing import Iterable, Iterator, Tuple
+from config import (
+    PIPELINE_PDF_WORKERS,
+    PIPELINE_LLM_CONCURRENCY,
+    PIPELINE_EMBED_BATCH_SIZE,
+    PDF_BACKEND,
+    PDF_PARALLEL_MIN_PAGES,
+    PDF_PAGES_PER_TASK,
+)
+from models.embeddings import embed_notes
+from utils.pdf_utils import extract_note, extract_pages, join_pages_note, pdf_text_cache
+from utils.file_utils import code_note, error_row, is_psych_eval, predict_codes_batch
+from utils.tracing import tracer
+
+
+def process_files(
+    uploaded_files: Iterable,
+    cpt_mapping,
+    cpt_icd_mapping_df,
+    icd_embedding_store,
+    pdf_workers: int = PIPELINE_PDF_WORKERS,
+    llm_concurrency: int = PIPELINE_LLM_CONCURRENCY,
+    embed_batch_size: int = PIPELINE_EMBED_BATCH_SIZE,
+) -> Iterator[Tuple[int, dict]]:
+    """
+    Staged batch version of process_file. Yields (input index, row) in
+    completion order; callers place rows by index to keep input order.
+
+      1. PDF load / de-identification / PHI extraction in a process pool;
+         files of PDF_PARALLEL_MIN_PAGES pages or more are split into page
+         ranges across the pool.
+      2. Note embeddings batched across notes (one encode call per batch).
+      3. LLM coding + ICD ranking in a thread pool of llm_concurrency workers,
+         one task per embedding batch (predict_codes_batch) so CPT calls, ICD
+         scoring, the cross-encoder and ICD selection are batched as well.
+
+    A file that fails to load or code yields an error_row (see
+    utils.file_utils.is_error_row) and the rest of the batch carries on; a
+    failed coding batch is retried note by note so only the bad note fails.
+    """
+    # Local files are handed to workers by path; uploads are sent as in-memory bytes
+    files = [(f.name, getattr(f, "path", None) or f.read()) for f in uploaded_files]
+    if not files:
+        return
+    # Workers only write the text cache; expiring entries is done once per batch here
+    pdf_text_cache.prune()
+
+    # spawn: the parent may already hold torch / gRPC threads, which fork does not copy safely
+    mp_context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, pdf_workers), mp_context=mp_context) as pdf_pool, \
+            ThreadPoolExecutor(max_workers=max(1, llm_concurrency)) as llm_pool:
+
+        def code_one(idx, note, emb=None):
+            try:
+                return [(idx, code_note(note, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store, emb))]
+            except Exception as exc:
+                return [(idx, error_row(exc))]
+
+        def code_batch(batch, embs):
+            try:
+                with tracer.trace(f"batch of {len(batch)}"):
+                    codes = predict_codes_batch(
+                        [note["clean"] for _, note in batch], cpt_mapping, icd_embedding_store, embs,
+                        [note["phi"] for _, note in batch],
+                    )
+                return [
+                    (idx, code_note(note, cpt_mapping, cpt_icd_mapping_df, icd_embedding_store, emb, c))
+                    for (idx, note), emb, c in zip(batch, embs, codes)
+                ]
+            except Exception:
+                return [row for (idx, note), emb in zip(batch, embs) for row in code_one(idx, note, emb)]
+
+        # Splitting a file only pays off when there are workers to share it with
+        split_min_pages = PDF_PARALLEL_MIN_PAGES if pdf_workers > 1 else 0
+        extract_futures = {
+            pdf_pool.submit(extract_note, name, data, PDF_BACKEND, split_min_pages): idx
+            for idx, (name, data) in enumerate(files)
+        }
+        page_futures = {}
+        splits = {}
+        coding_futures = set()
+        embed_buffer = []
+        failed = []
+
+        def fail(idx, exc):
+            failed.append((idx, error_row(exc)))
+
+        def flush_embeddings():
+            start = time.perf_counter()
+            try:
+                embs = embed_notes([note["clean"] for _, note in embed_buffer])
+            except Exception as exc:
+                for idx, _ in embed_buffer:
+                    fail(idx, exc)
+                embed_buffer.clear()
+                return
+            batch_ms = round((time.perf_counter() - start) * 1000, 3)
+            for _, note in embed_buffer:
+                # Batch time is shared by every note in the batch
+                note["spans"].append(
+                    {"name": "embed_texts", "ms": batch_ms, "batch_size": len(embed_buffer)}
+                )
+            coding_futures.add(llm_pool.submit(code_batch, list(embed_buffer), embs))
+            embed_buffer.clear()
+
+        pending = set(extract_futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in extract_futures:
+                    idx = extract_futures.pop(future)
+                    try:
+                        note = future.result()
+                    except Exception as exc:
+                        fail(idx, exc)
+                        continue
+                    if "clean" not in note:
+                        # Large file: extract page ranges in parallel, then join and scan
+                        step = max(1, PDF_PAGES_PER_TASK)
+                        starts = range(0, note["pages"], step)
+                        splits[idx] = (note, [None] * len(starts), time.perf_counter())
+                        for part, start in enumerate(starts):
+                            page_future = pdf_pool.submit(
+                                extract_pages, files[idx][1], start, start + step, note["backend"]
+                            )
+                            page_futures[page_future] = (idx, part)
+                    elif is_psych_eval(note):
+                        coding_futures.add(llm_pool.submit(code_one, idx, note))
+                    else:
+                        embed_buffer.append((idx, note))
+                elif future in page_futures:
+                    idx, part = page_futures.pop(future)
+                    if idx not in splits:
+                        # Another page range of this file already failed
+                        continue
+                    split, parts, started = splits[idx]
+                    try:
+                        parts[part] = future.result()
+                    except Exception as exc:
+                        del splits[idx]
+                        fail(idx, exc)
+                        continue
+                    if all(p is not None for p in parts):
+                        del splits[idx]
+                        ms = (time.perf_counter() - started) * 1000
+                        page_texts = [text for p in parts for text in p]
+                        extract_futures[pdf_pool.submit(join_pages_note, split, page_texts, ms)] = idx
+                else:
+                    coding_futures.discard(future)
+                    yield from future.result()
+
+            extracting = extract_futures or page_futures
+            if embed_buffer and (len(embed_buffer) >= embed_batch_size or not extracting):
+                flush_embeddings()
+            yield from failed
+            failed.clear()
+            pending = set(extract_futures) | set(page_futures) | coding_futures
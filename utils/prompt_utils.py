@@ -0,0 +1,145 @@
+"""
+Token-budgeted compaction of de-identified notes before they go into the
+Gemini prompts. Notes within the budget are sent unchanged. Over budget,
+repeated long lines (page headers, copied boilerplate) are dropped first;
+short lines such as repeated form answers ("Denies") are always kept.
+Notes still over budget keep CPT cue lines (duration, service code,
+crisis / intake wording), then the clinical sections (interventions,
+assessment, mental status, diagnosis, plan, objectives), then everything
+else, in that priority and in original line order. Empty form fields are
+dropped before other lines are cut.
+
+Tokens are counted with the local Hugging Face tokenizer of
+PROMPT_TOKENIZER (never downloaded; the embedder's files are usually in
+the cache already) or, when it is not available, a word/punctuation
+approximation.
+"""
+import re
+import threading
+from functools import lru_cache
+from typing import List, Tuple
+from config import PROMPT_COMPACTION, PROMPT_TOKEN_BUDGET, PROMPT_TOKENIZER
+from utils.cpt_utils import CRISIS_CUE_RE, INTAKE_CUE_RE
+
+# Bump when the compaction rules change (part of the result cache key)
+COMPACTION_VERSION = "2"
+
+# Only lines of at least this many words are de-duplicated
+DEDUP_MIN_WORDS = 6
+
+APPROX_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+CUE_LINE_RE = re.compile(r"^(?:Duration|Service Code|Total Time(?: Spent)?)\b", re.IGNORECASE)
+SECTION_RE = re.compile(
+    r"^(?:Interventions?(?: Used)?|(?:Risk )?Assessment|(?:Current )?Mental Status(?: Exam)?|MSE"
+    r"|Diagnos[ie]s|Dx|Subjective|Objectives?|Plan|Treatment Plan(?: Progress)?|Progress"
+    r"|Presenting Problem|Chief Complaint|Session Focus|Response to Interventions?)\b[^.]{0,40}$",
+    re.IGNORECASE,
+)
+EMPTY_FIELD_RE = re.compile(r"^[\w /&()#-]{1,40}:\s*(?:_+|-+|N/?A|None)?\s*$", re.IGNORECASE)
+
+# Line priorities: lower is kept first
+CUE, CLINICAL, OTHER, EMPTY_FIELD = range(4)
+
+
+@lru_cache(maxsize=None)
+def _tokenizer(name: str):
+    if not name:
+        return None
+    try:
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(name, local_files_only=True)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, tokenizer_name: str = PROMPT_TOKENIZER) -> int:
+    tokenizer = _tokenizer(tokenizer_name)
+    if tokenizer is None:
+        return len(APPROX_TOKEN_RE.findall(text))
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def _line_priorities(lines: List[str]) -> List[int]:
+    priorities = []
+    in_clinical = False
+    for line in lines:
+        if SECTION_RE.match(line):
+            in_clinical = True
+            priorities.append(CLINICAL)
+        elif CUE_LINE_RE.match(line) or CRISIS_CUE_RE.search(line) or INTAKE_CUE_RE.search(line):
+            priorities.append(CUE)
+        elif EMPTY_FIELD_RE.match(line):
+            priorities.append(EMPTY_FIELD)
+        else:
+            priorities.append(CLINICAL if in_clinical else OTHER)
+    return priorities
+
+
+def compact_note(clean: str, budget: int = PROMPT_TOKEN_BUDGET,
+                 tokenizer_name: str = PROMPT_TOKENIZER) -> Tuple[str, int, int]:
+    """(compacted text, tokens before, tokens after) for a de-identified note."""
+    before = count_tokens(clean, tokenizer_name)
+    if before <= budget:
+        return clean, before, before
+
+    seen = set()
+    lines = []
+    for line in clean.splitlines():
+        if len(line.split()) >= DEDUP_MIN_WORDS:
+            if line in seen:
+                continue
+            seen.add(line)
+        lines.append(line)
+    text = "\n".join(lines)
+    after = count_tokens(text, tokenizer_name)
+    if after <= budget:
+        return text, before, after
+
+    # Over budget: keep lines by priority, then in order, while they fit
+    costs = [count_tokens(line, tokenizer_name) + 1 for line in lines]
+    priorities = _line_priorities(lines)
+    keep = set()
+    used = 0
+    for i in sorted(range(len(lines)), key=lambda i: (priorities[i], i)):
+        if priorities[i] == EMPTY_FIELD:
+            break
+        if used + costs[i] <= budget:
+            keep.add(i)
+            used += costs[i]
+    text = "\n".join(line for i, line in enumerate(lines) if i in keep)
+    return text, before, count_tokens(text, tokenizer_name)
+
+
+class NoteCompactor:
+    """compact_note with process-wide token counts (tokens saved per note)."""
+
+    def __init__(self, enabled: bool = PROMPT_COMPACTION, budget: int = PROMPT_TOKEN_BUDGET):
+        self.enabled = enabled
+        self.budget = budget
+        self.notes = 0
+        self.over_budget = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._lock = threading.Lock()
+
+    def compact(self, clean: str) -> Tuple[str, int, int]:
+        if not self.enabled:
+            return clean, 0, 0
+        text, before, after = compact_note(clean, self.budget)
+        with self._lock:
+            self.notes += 1
+            self.over_budget += before > self.budget
+            self.tokens_before += before
+            self.tokens_after += after
+        return text, before, after
+
+    def stats(self) -> dict:
+        return {
+            "notes": self.notes,
+            "over_budget": self.over_budget,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+        }
+
+
+note_compactor = NoteCompactor()
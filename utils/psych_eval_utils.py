@@ -21,7 +21,11 @@ def count_procedures(note_text: str) -> int:
     )
     if not procedures_match:
         return 0
-    procedures_text = re.sub(r"([a-zA-Z])(\d+)", r"\1 \2", procedures_match.group(1))
+    return count_procedures_in_block(procedures_match.group(1))
+
+
+def count_procedures_in_block(procedures_block: str) -> int:
+    procedures_text = re.sub(r"([a-zA-Z])(\d+)", r"\1 \2", procedures_block)
     matches = re.findall(r"\b\d+\s*minutes?\b", procedures_text, re.IGNORECASE)
     return len(matches)
 
@@ -34,10 +38,14 @@ def contains_psychometrist(note_text: str) -> bool:
     )
     if not procedures_match:
         return False
+    return psychometrist_in_block(procedures_match.group(1))
+
+
+def psychometrist_in_block(procedures_block: str) -> bool:
     return bool(
         re.search(
             r"\b(administration by )?psychometrist\b",
-            procedures_match.group(1),
+            procedures_block,
             re.IGNORECASE,
         )
     )
@@ -56,13 +64,23 @@ def calculate_code_units(code, time):
         return 1
 
 
-def extract_psych_eval_data(text: str) -> dict:
-    phi_data = get_phi(text)
+def extract_psych_eval_data(text: str, scan: dict = None) -> dict:
+    """
+    scan is the utils.note_scanner.scan_note result for text; when given, the
+    PHI and "Procedures" section it already extracted are reused.
+    """
+    if scan is None:
+        phi_data = get_phi(text)
+        procedure_count = count_procedures(text)
+        by_psychometrist = contains_psychometrist(text)
+    else:
+        phi_data = scan["phi"]
+        block = scan["procedures"]
+        procedure_count = count_procedures_in_block(block) if block is not None else 0
+        by_psychometrist = psychometrist_in_block(block) if block is not None else False
     service_code = phi_data.get("Service Code", "")
     diagnosis_codes = phi_data.get("Diagnosis Codes")
     total_time = extract_total_time(text)
-    procedure_count = count_procedures(text)
-    by_psychometrist = contains_psychometrist(text)
     code_units = calculate_code_units(service_code, total_time)
 
     return {
@@ -0,0 +1,173 @@
+"""
+Lightweight per-note tracing.
+
+    with tracer.trace(note_name):
+        with tracer.span("predict_cpt_code") as span:
+            span.set("cache_hit", False)
+
+Spans opened outside a trace (or with tracing disabled) are a shared no-op
+object, so instrumented code costs one ContextVar lookup when nothing is
+recording. Finished traces go to every registered sink.
+"""
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+from config import TRACE_ENABLED, TRACE_PATH
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+    def incr(self, key, amount=1):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Trace:
+    def __init__(self, note: str):
+        self.note = note
+        self.spans: List[dict] = []
+        self.attrs = {}
+
+    def add_span(self, name: str, ms: float, **attrs):
+        """Record a span measured elsewhere (e.g. in a worker process)."""
+        self.spans.append({"name": name, "ms": round(ms, 3), **attrs})
+
+    def to_dict(self, total_ms: float) -> dict:
+        return {"note": self.note, "total_ms": round(total_ms, 3), **self.attrs, "spans": self.spans}
+
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "start")
+
+    def __init__(self, trace: Trace, name: str, attrs: dict):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.add_span(self.name, (time.perf_counter() - self.start) * 1000, **self.attrs)
+        return False
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def incr(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+
+class JsonlSink:
+    """Appends one JSON line per finished trace."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class MemorySink:
+    """Keeps the most recent traces in memory, e.g. for the Streamlit breakdown panel."""
+
+    def __init__(self, maxlen: int = 5000):
+        self.records = deque(maxlen=maxlen)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def emit(self, record: dict):
+        with self._lock:
+            self.records.append(record)
+            self.count += 1
+
+    def since(self, count: int) -> List[dict]:
+        """Records emitted after the sink's count was `count` (still in the buffer)."""
+        with self._lock:
+            new = self.count - count
+            return list(self.records)[-new:] if new > 0 else []
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True, sinks=None):
+        self.enabled = enabled
+        self.sinks = list(sinks or [])
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    @contextmanager
+    def trace(self, note: str):
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(note)
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            record = trace.to_dict((time.perf_counter() - start) * 1000)
+            for sink in self.sinks:
+                sink.emit(record)
+
+    def span(self, name: str, **attrs):
+        trace = _current_trace.get()
+        if trace is None:
+            return NULL_SPAN
+        return Span(trace, name, attrs)
+
+    def current(self) -> Optional[Trace]:
+        return _current_trace.get()
+
+
+def stage_breakdown(records: List[dict]) -> List[dict]:
+    """Aggregate span timings across traces: one row per span name."""
+    by_stage = {}
+    for record in records:
+        for span in record["spans"]:
+            by_stage.setdefault(span["name"], []).append(span["ms"])
+    rows = []
+    for name, values in by_stage.items():
+        values.sort()
+        rows.append({
+            "Stage": name,
+            "Calls": len(values),
+            "Total (s)": round(sum(values) / 1000, 2),
+            "Mean (ms)": round(sum(values) / len(values), 1),
+            "p95 (ms)": round(values[min(len(values) - 1, int(len(values) * 0.95))], 1),
+        })
+    return sorted(rows, key=lambda r: -r["Total (s)"])
+
+
+memory_sink = MemorySink()
+tracer = Tracer(
+    enabled=TRACE_ENABLED,
+    sinks=[memory_sink] + ([JsonlSink(TRACE_PATH)] if TRACE_PATH else []),
+)
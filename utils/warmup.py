@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import Optional, Tuple
+from models.embeddings import registry
+from models.llm import structured_llm, icd_structured_llm
+from utils.data_utils import load_mappings, build_embeddings, invalidate_embeddings, MAPPING_FILE
+from utils.tracing import tracer
+
+
+class Warmup:
+    """
+    Loads the mapping sheet, the ICD embedding store, the encoders and the
+    Gemini client on a background thread so the UI can render immediately.
+    Per-step timings (seconds) are kept in `timings` and emitted as a
+    "startup" trace. result() reloads the mapping sheet and rebuilds the ICD
+    store when the sheet has been edited since the last call.
+    """
+
+    def __init__(self, mapping_file: str = MAPPING_FILE, models=("embedder", "cross_encoder")):
+        self.mapping_file = mapping_file
+        self.models = models
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.ui_ready: Optional[float] = None
+        self.timings = {}
+        self._resources = None
+        self._error: Optional[BaseException] = None
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+
+    def start(self) -> "Warmup":
+        self._thread.start()
+        return self
+
+    def _step(self, name, fn):
+        start = time.perf_counter()
+        with tracer.span(name):
+            result = fn()
+        self.timings[name] = round(time.perf_counter() - start, 3)
+        return result
+
+    def _run(self):
+        try:
+            with tracer.trace("startup"):
+                df, mapping = self._step("load_mappings", lambda: load_mappings(self.mapping_file))
+                for name in self.models:
+                    self._step(f"load_{name}", lambda: registry.warm_up((name,)))
+                store = self._step(
+                    "build_embeddings", lambda: build_embeddings(df, self.mapping_file)
+                )
+                self._step("load_llm", lambda: (structured_llm.runnable, icd_structured_llm.runnable))
+            self._resources = (df, mapping, store)
+        except BaseException as exc:
+            self._error = exc
+        finally:
+            self.finished = time.perf_counter()
+
+    def mark_ui_ready(self):
+        """Record (once) how long after warm-up start the first page render finished."""
+        if self.ui_ready is None:
+            self.ui_ready = round(time.perf_counter() - self.started, 3)
+
+    def ready(self) -> bool:
+        return self.finished is not None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def result(self, timeout: Optional[float] = None) -> Tuple:
+        """Block until warm-up finishes; returns (cpt_icd_mapping_df, cpt_mapping, icd_embedding_store)."""
+        self._thread.join(timeout)
+        if self._error is not None:
+            raise self._error
+        if self._resources is None:
+            raise TimeoutError("Warm-up still running")
+        self._reload_if_changed()
+        return self._resources
+
+    def _reload_if_changed(self):
+        with self._reload_lock:
+            df, _, store = self._resources
+            new_df, new_mapping = load_mappings(self.mapping_file)
+            if new_df is df:
+                return
+            with tracer.trace("reload_mappings"):
+                new_store = self._step(
+                    "reload_mappings", lambda: build_embeddings(new_df, self.mapping_file)
+                )
+            self._resources = (new_df, new_mapping, new_store)
+            if new_store is not store:
+                invalidate_embeddings(store)
+            self.reloads += 1